@@ -0,0 +1,74 @@
+"""
+Import-time benchmark for the cold start of app processes (CLI rebuild, server workers, tests).
+
+Each module is imported in a fresh interpreter several times and the median wall time is reported, together
+with the slowest imports (by cumulative time from `python -X importtime`) and a check that the deferred
+dependencies are not imported at startup.
+
+Run from the project root: python -m benchmarks.import_time
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = ['src.drivers', 'src.database', 'src.app']
+DEFERRED = ['flasgger', 'wikipedia', 'xml.etree.ElementTree']
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    """Run python code in a fresh interpreter with the project root on the path"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([PROJECT_ROOT, os.path.join(PROJECT_ROOT, 'src')]))
+    return subprocess.run([sys.executable, *options, '-c', code], env=env, cwd=os.path.join(PROJECT_ROOT, 'src'),
+                          capture_output=True, text=True, check=True)
+
+
+def import_wall_time(module: str, repeat: int) -> float:
+    """Return the median wall time (seconds) of importing module in a fresh interpreter"""
+    baseline, times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run_python('pass')
+        baseline.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        run_python(f'import {module}')
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) - statistics.median(baseline)
+
+
+def slowest_imports(module: str, top: int) -> list:
+    """Return the list of (cumulative microseconds, module name) of the slowest imports of module"""
+    stderr = run_python(f'import {module}', '-X', 'importtime').stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+    imports.sort(reverse=True)
+    return imports[:top]
+
+
+def deferred_imported(module: str) -> list:
+    """Return the deferred dependencies which are imported anyway by importing module"""
+    code = f'import sys, {module}; print(" ".join(m for m in {DEFERRED!r} if m in sys.modules))'
+    return run_python(code).stdout.split()
+
+
+parser = argparse.ArgumentParser('Import-time benchmark')
+parser.add_argument('-n', '--repeat', type=int, default=5, help='Number of runs for each module')
+parser.add_argument('-t', '--top', type=int, default=10, help='Number of the slowest imports to show')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    for module in MODULES:
+        print(f'{module}: {import_wall_time(module, args.repeat) * 1000:.1f} ms (median of {args.repeat})')
+        for cumulative, name in slowest_imports(module, args.top):
+            print(f'    {cumulative / 1000:8.1f} ms  {name}')
+        imported = deferred_imported(module)
+        if imported:
+            print('    deferred but imported:', ', '.join(imported))
@@ -0,0 +1,242 @@
+"""
+Load test of the app: the capacity (requests per second) and latency of the pages and api under concurrent
+mixed traffic.
+
+A synthetic database of many drivers is generated and ingested (or an existing one is reused with --db), then the
+app is served from it by pre-forked workers as in production (see serve.py), with wikipedia replaced by a local
+stub (with configurable latency). Client threads send requests to randomly chosen routes (weighted, see TRAFFIC)
+for the given duration. The throughput, p50/p95/p99 latency and error rate of each route are reported.
+The server runs in separate processes, so the client threads do not compete with it for the GIL, but a high
+concurrency may still saturate the client itself (watch the cpu usage of the load test process).
+
+Relies on os.fork (Unix only). Run from the project root: python -m benchmarks.load_test -c 8 -d 10 -w 4
+"""
+
+import argparse
+import datetime as dt
+import http.client
+import logging
+import os
+import random
+import signal
+import string
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from itertools import product
+from urllib.parse import quote
+
+import peewee
+
+import src.database as database
+import src.serve as serve
+import src.utils as utils
+from src.drivers import ABBR_FILE, START_LOG_FILE, END_LOG_FILE
+from src.ingest import IngestSession
+from src.stats import percentile
+
+FIRST_NAMES = ['Lewis', 'Sebastian', 'Kimi', 'Max', 'Daniel', 'Fernando', 'Charles', 'Carlos', 'Pierre', 'Esteban']
+# route name: weight, url templates ({abbr}, {first_name} and {team} are replaced with random values from the db)
+TRAFFIC = {
+    '/report': (10, ['/report', '/report?order=desc']),
+    '/drivers': (10, ['/drivers', '/drivers?order=desc']),
+    '/drivers?driver_id': (10, ['/drivers?driver_id={abbr}']),
+    '/api/v1/drivers/': (10, ['/api/v1/drivers/', '/api/v1/drivers/?format=xml']),
+    '/api/v1/drivers/<driver_id>/': (10, ['/api/v1/drivers/{abbr}/']),
+    '/api/v1/report/': (10, ['/api/v1/report/', '/api/v1/report/?format=columns',
+                             '/api/v1/report/?within_ms=1000', '/api/v1/report/?percentile=10']),
+    '/api/v1/stats/': (5, ['/api/v1/stats/']),
+    '/api/v1/search/': (10, ['/api/v1/search/?q={abbr}', '/api/v1/search/?q={first_name}']),
+    '/api/v1/teams/': (5, ['/api/v1/teams/']),
+    '/api/v1/teams/<team_name>/': (5, ['/api/v1/teams/{team}/']),
+}
+WIKI_TEXT = '{name} is a racing driver.\n\n== Career ==\n{name} raced in the synthetic championship.'
+
+
+def generate_data(path: str, drivers: int, teams: int, seed: int = 0) -> None:
+    """Write data files (abbreviations and start/end logs) of a synthetic race to the path directory.
+    Abbreviations are 3 letters, so there can be up to 17576 drivers"""
+    rng = random.Random(seed)
+    abbrs = [''.join(letters) for letters in product(string.ascii_uppercase, repeat=3)]
+    if not 0 < drivers <= len(abbrs):
+        raise ValueError(f'Number of drivers must be from 1 to {len(abbrs)}')
+    race_start = dt.datetime(2018, 5, 24, 12)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, ABBR_FILE), 'w', encoding='utf-8') as abbr_file, \
+            open(os.path.join(path, START_LOG_FILE), 'w') as start_log, \
+            open(os.path.join(path, END_LOG_FILE), 'w') as end_log:
+        for abbr in rng.sample(abbrs, drivers):
+            name = f'{rng.choice(FIRST_NAMES)} {abbr.capitalize()}{rng.choice(["son", "ini", "er", "ez"])}'
+            abbr_file.write(f'{abbr}_{name}_TEAM {rng.randrange(teams) + 1:03d}\n')
+            start = race_start + dt.timedelta(milliseconds=rng.randrange(3_600_000))
+            stop = start + dt.timedelta(milliseconds=round(rng.lognormvariate(11.2, 0.05)))
+            start_log.write(f'{abbr}{start:%Y-%m-%d_%H:%M:%S.%f}'[:-3] + '\n')
+            end_log.write(f'{abbr}{stop:%Y-%m-%d_%H:%M:%S.%f}'[:-3] + '\n')
+
+
+def build_db(data_path: str, filename: str, verbose: bool = False) -> None:
+    """Ingest the data files to a new db file"""
+    session = IngestSession(data_path)
+    session.parse()
+    with database.new_db_file(filename, verbose) as new_db:
+        session.save(new_db, verbose)
+
+
+def sample_values(filename: str) -> dict:
+    """Return the values (driver abbreviations, first names, team names) to fill the url templates"""
+    db = peewee.SqliteDatabase(filename)
+    with db:
+        drivers = list(database.Driver.select(database.Driver.abbr, database.Driver.name).tuples().execute(db))
+        teams = list(database.Team.select(database.Team.name).tuples().execute(db))
+        return {
+            'abbr': [abbr for abbr, _ in drivers],
+            'first_name': sorted({name.split()[0] for _, name in drivers}),
+            'team': [quote(name) for name, in teams],
+        }
+
+
+def stub_wiki(delay: float) -> None:
+    """Replace wikipedia requests with a local stub answering after delay seconds"""
+    def wiki_content(name: str) -> str:
+        time.sleep(delay)
+        return WIKI_TEXT.format(name=name)
+
+    utils.wiki_content = wiki_content
+
+
+def start_workers(db_file: str, workers: int) -> tuple:
+    """Fork the workers serving the app from db_file on a free local port (see serve.py).
+    Return the port and the list of worker pids"""
+    sock = serve.listen('127.0.0.1', 0)
+    # the access log of each request would slow the workers down and flood the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    pids = serve.fork_workers(sock, db_file, workers)
+    port = sock.getsockname()[1]
+    sock.close()
+    return port, pids
+
+
+def stop_workers(pids: list) -> None:
+    """Terminate the workers and wait for them"""
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+def wait_ready(port: int, timeout: float = 30) -> None:
+    """Wait until the server answers"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+            connection.request('GET', '/api/v1/stats/')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def run_client(port: int, values: dict, duration: float, seed: int, results: list) -> None:
+    """Send requests to random routes for duration seconds, append (route, latency in seconds, ok) to results"""
+    rng = random.Random(seed)
+    routes = list(TRAFFIC)
+    weights = [weight for weight, _ in TRAFFIC.values()]
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    deadline = time.perf_counter() + duration
+    while True:
+        route = rng.choices(routes, weights)[0]
+        url = rng.choice(TRAFFIC[route][1]).format(**{key: rng.choice(value) for key, value in values.items()})
+        start = time.perf_counter()
+        if start > deadline:
+            break
+        try:
+            connection.request('GET', url)
+            response = connection.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            ok = False
+        results.append((route, time.perf_counter() - start, ok))
+    connection.close()
+
+
+def run_load(port: int, values: dict, concurrency: int, duration: float, seed: int = 0) -> tuple:
+    """Run concurrent clients. Return the list of (route, latency, ok) of all requests and the elapsed time"""
+    results = []
+    threads = [threading.Thread(target=run_client, args=(port, values, duration, seed + ind, results))
+               for ind in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def route_statistics(results: list, elapsed: float) -> dict:
+    """Return the statistics of each route and of all of them ('total'): number of requests, requests per second,
+    p50/p95/p99 latency (milliseconds) and the error rate (%)"""
+    latencies, errors = defaultdict(list), defaultdict(int)
+    for route, latency, ok in results:
+        for key in (route, 'total'):
+            latencies[key].append(latency * 1000)
+            errors[key] += not ok
+    stats = {}
+    for route in [route for route in TRAFFIC if route in latencies] + (['total'] if results else []):
+        values = sorted(latencies[route])
+        stats[route] = {
+            'requests': len(values),
+            'rps': len(values) / elapsed,
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'errors': errors[route] / len(values) * 100,
+        }
+    return stats
+
+
+def print_statistics(stats: dict) -> None:
+    print(f'{"route":<30}{"requests":>10}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors":>9}')
+    for route, s in stats.items():
+        print(f'{route:<30}{s["requests"]:>10}{s["rps"]:>10.1f}{s["p50"]:>10.1f}{s["p95"]:>10.1f}{s["p99"]:>10.1f}'
+              f'{s["errors"]:>8.1f}%')
+
+
+parser = argparse.ArgumentParser('Load test of the app with concurrent mixed traffic')
+parser.add_argument('-c', '--concurrency', type=int, default=8, help='Number of concurrent clients')
+parser.add_argument('-d', '--duration', type=float, default=10, help='Duration of the test in seconds')
+parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of server worker processes')
+parser.add_argument('--drivers', type=int, default=10000, help='Number of drivers in the synthetic db')
+parser.add_argument('--teams', type=int, default=100, help='Number of teams in the synthetic db')
+parser.add_argument('--db', help='Db file to reuse (it is generated if it does not exist). Temporary by default')
+parser.add_argument('--wiki-delay', type=float, default=0.05, help='Latency of the wikipedia stub in seconds')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data and of the traffic')
+parser.add_argument('-v', '--verbose', action='store_true', help='Print db generation progress')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.abspath(args.db) if args.db else os.path.join(tmp_dir, 'racing.db')
+        if not os.path.exists(db_file):
+            print(f'Generating a db of {args.drivers} drivers: {db_file}')
+            generate_data(tmp_dir, args.drivers, args.teams, args.seed)
+            build_db(tmp_dir, db_file, args.verbose)
+
+        stub_wiki(args.wiki_delay)
+        port, pids = start_workers(db_file, args.workers)
+        try:
+            wait_ready(port)
+            print(f'Running {args.concurrency} clients for {args.duration:g} s against {args.workers} workers')
+            results, elapsed = run_load(port, sample_values(db_file), args.concurrency, args.duration, args.seed)
+        finally:
+            stop_workers(pids)
+    print_statistics(route_statistics(results, elapsed))
@@ -1,56 +1,108 @@
 """
-This module defines flask_restful API resources and adds custom representation for xml (json is standard)
+This module defines flask_restful API resources and adds custom representations for xml and column-oriented json
+(json is standard)
 """
 
-from flask import make_response, request
+from flask import Response, make_response, request, stream_with_context
 from flask_restful import Resource, Api
 from flask_restful.representations.json import output_json
-import xml.etree.ElementTree as ET
 
 from src.drivers import Driver
+from src.export import EXPORT_FORMATS, EXPORT_TABLES, export_chunks
+from src.stats import count_percentile, count_within, lap_statistics
+from src.teams import Team
+from src.utils import single_flight
+
+FORMATS = {
+    'json': 'application/json',
+    'xml': 'application/xml',
+    'columns': 'application/vnd.racing.columns+json',
+}
 
 
 class CustomApi(Api):
     """
     Custom flask_restful Api class for:
-        - providing additional representation (xml)
+        - providing additional representations (xml, column-oriented json)
         - output function to convert data (dicts) to xml strings
+        - output function to convert lists of entries (dicts of dicts) to columns
     """
 
     @staticmethod
     def output_xml(data: dict, code, headers: dict = None) -> "Response":
         """Make a Flask response with xml body (output function for xml representation, which we added in __init__)"""
+        import xml.etree.ElementTree as ET
 
-        def dict_to_tree_recursive(src_dict: dict, root: ET.Element = None) -> ET.Element:
-            """Convert the data dict to the etree.Element object (including all children) recursively.
-            src_dict (data) is always a dict with a single key at the top level -- this is used as the root tag"""
-            if root is None:
-                src_top_key = next(iter(src_dict.keys()))
-                root = ET.Element(src_top_key)
-
+        def dict_to_tree_recursive(src_dict: dict, root: ET.Element) -> ET.Element:
+            """Add the data dict items to the root element as its children (recursively for nested dicts,
+            an empty dict adds no children). Return root"""
             for key, value in src_dict.items():
                 child = ET.SubElement(root, key)
                 if isinstance(value, dict):
                     dict_to_tree_recursive(value, child)
                 else:
                     child.text = value
-            return root[0]
+            return root
 
-        tree = dict_to_tree_recursive(data)
+        # data is always a dict with a single key at the top level -- this is used as the root tag
+        tree = dict_to_tree_recursive(data, ET.Element('data'))[0]
         xml_string = ET.tostring(tree, xml_declaration=True, encoding="utf-8")
-        resp = make_response(xml_string)
+        resp = make_response(xml_string, code)
         resp.headers.extend(headers or {})
         return resp
 
+    @staticmethod
+    def output_columns(data: dict, code, headers: dict = None) -> "Response":
+        """Make a Flask response with column-oriented json body.
+        Entries (flat dicts) like {'driver1': {'name': ..}, 'driver2': {'name': ..}} become {'name': [.., ..]},
+        so the keys are sent once instead of on every entry. Other values are left as they are"""
+
+        def is_entry(value) -> bool:
+            return isinstance(value, dict) and not any(isinstance(v, dict) for v in value.values())
+
+        def to_columns(value):
+            if isinstance(value, dict) and value and all(is_entry(v) for v in value.values()):
+                entries = list(value.values())
+                return {key: [entry.get(key) for entry in entries] for key in entries[0]}
+            if isinstance(value, dict):
+                return {key: to_columns(v) for key, v in value.items()}
+            return value
+
+        return output_json({key: to_columns(value) for key, value in data.items()}, code, headers)
+
     def __init__(self, *args, **kwargs):
-        """Register representation for xml"""
+        """Register representations for xml and column-oriented json"""
         super().__init__(*args, **kwargs)
         self.representations = {
-            'application/json': output_json,
-            'application/xml': __class__.output_xml,
+            FORMATS['json']: output_json,
+            FORMATS['xml']: __class__.output_xml,
+            FORMATS['columns']: __class__.output_columns,
         }
 
 
+def set_response_format() -> str:
+    """Choose the representation by the 'format' query argument (json if not specified or unknown).
+    Return the chosen format name"""
+    fmt = request.args.get('format') if request.args.get('format') in FORMATS else 'json'
+    request.environ['HTTP_ACCEPT'] = FORMATS[fmt]
+    return fmt
+
+
+def fragments_response(fmt: str, top_key: str, item_key: str, fragments: list) -> "Response":
+    """Make a Flask response by joining pre-rendered driver fragments (json or xml) instead of building dicts
+    and encoding them. The body is the same as the representation of {top_key: {item_key1: {..}, ..}} would be"""
+    items = enumerate(fragments, start=1)
+    if fmt == 'xml':
+        body = ("<?xml version='1.0' encoding='utf-8'?>\n<" + top_key + '>'
+                + ''.join(f'<{item_key}{ind}>{fragment}</{item_key}{ind}>' for ind, fragment in items)
+                + '</' + top_key + '>')
+    else:
+        body = ('{"' + top_key + '": {'
+                + ', '.join(f'"{item_key}{ind}": {fragment}' for ind, fragment in items)
+                + '}}\n')
+    return make_response(body.encode('utf-8'), 200, {'Content-Type': FORMATS[fmt]})
+
+
 class DriversListApi(Resource):
     def get(self) -> dict:
         """Return the drivers list API.
@@ -61,7 +113,7 @@ class DriversListApi(Resource):
          - in: query
            name: format
            type: string
-           enum: ['json', 'xml']
+           enum: ['json', 'xml', 'columns']
            required: false
            description: Specify which format the response will be in
 
@@ -115,8 +167,11 @@ class DriversListApi(Resource):
              $ref: '#/definitions/Drivers'
             """
 
-        request.environ['HTTP_ACCEPT'] = 'application/xml' if request.args.get(
-            'format') == 'xml' else 'application/json'
+        fmt = set_response_format()
+        if fmt != 'columns':
+            fragments = single_flight.do(('fragments', fmt), lambda: Driver.all_fragments(fmt))
+            if all(fragments):
+                return fragments_response(fmt, 'drivers', 'driver', fragments)
 
         drivers_dic = {'drivers': {}}
         for ind, d in enumerate(Driver.all()):
@@ -139,7 +194,7 @@ class DriverApi(Resource):
          - in: query
            name: format
            type: string
-           enum: ['json', 'xml']
+           enum: ['json', 'xml', 'columns']
            required: false
            description: Specify which format the response will be in
         responses:
@@ -151,11 +206,11 @@ class DriverApi(Resource):
             description: A driver with the specified ID/abbr/name was not found
         """
 
-        request.environ['HTTP_ACCEPT'] = 'application/xml' if request.args.get(
-            'format') == 'xml' else 'application/json'
+        set_response_format()
 
         try:
-            d = Driver.get_by_id(driver_id)[0].driver_info_dictionary()
+            drivers = single_flight.do(('driver', driver_id), lambda: Driver.get_by_id(driver_id))
+            d = drivers[0].driver_info_dictionary()
             result_dic = {'driver': d}
         except IndexError:
             return {'error': f'driver \'{driver_id}\' not found'}, 404
@@ -164,14 +219,30 @@ class DriverApi(Resource):
 
 class ReportApi(Resource):
     def get(self) -> dict:
-        """Return the report about the race.
+        """Return the report about the race (places by best lap time), optionally only its top:
+        the drivers within a gap to the fastest lap and/or up to a percentile of the field.
 
          ---
         parameters:
+         - in: query
+           name: within_ms
+           type: integer
+           minimum: 0
+           required: false
+           description: Only the drivers with the best lap within this gap (milliseconds) to the fastest lap
+           example: 1000
+         - in: query
+           name: percentile
+           type: number
+           minimum: 0
+           maximum: 100
+           required: false
+           description: Only the drivers with the best lap up to this percentile of the field
+           example: 25
          - in: query
            name: format
            type: string
-           enum: ['json', 'xml']
+           enum: ['json', 'xml', 'columns']
            required: false
            description: Specify which format the response will be in
 
@@ -180,13 +251,360 @@ class ReportApi(Resource):
            description: Report
            schema:
              $ref: '#/definitions/Report'
+         400:
+            description: within_ms or percentile is invalid
         """
-        request.environ['HTTP_ACCEPT'] = 'application/xml' if request.args.get(
-            'format') == 'xml' else 'application/json'
+        fmt = set_response_format()
+
+        within_ms = request.args.get('within_ms', type=int)
+        percentile = request.args.get('percentile', type=float)
+        if ('within_ms' in request.args and (within_ms is None or within_ms < 0)
+                or 'percentile' in request.args and (percentile is None or not 0 <= percentile <= 100)):
+            return {'error': 'within_ms must be a non-negative integer, percentile must be from 0 to 100'}, 400
+        # places are in order of best lap, so both filters keep the first places: count them in the lap index
+        limits = []
+        if within_ms is not None:
+            limits.append(count_within(within_ms))
+        if percentile is not None:
+            limits.append(count_percentile(percentile))
+        limit = min(limits) if limits else None
+
+        if fmt != 'columns':
+            fragments = single_flight.do(('report fragments', fmt, limit),
+                                         lambda: Driver.all_fragments(fmt, by_best_lap=True, limit=limit))
+            if all(fragments):
+                return fragments_response(fmt, 'report', 'place', fragments)
 
         report_dic = {'report': {}}
-        drivers = Driver.all()
-        drivers.sort(key=lambda d: d.best_lap)
-        for ind, d in enumerate(drivers):
+        for ind, d in enumerate(Driver.all(by_best_lap=True, limit=limit)):
             report_dic['report'].update({f'place{ind + 1}': d.driver_info_dictionary()})
         return report_dic
+
+
+class StatsApi(Resource):
+    def get(self) -> dict:
+        """Return the statistics of best lap times of the field (with the histogram) and of each team
+        (fastest team first).
+
+         ---
+        parameters:
+         - in: query
+           name: format
+           type: string
+           enum: ['json', 'xml', 'columns']
+           required: false
+           description: Specify which format the response will be in
+
+        definitions:
+          FieldStats:
+            type: object
+            properties:
+               drivers:
+                 type: string
+                 example: "19"
+               fastest_lap_time:
+                 type: timedelta
+                 example: "0:01:12.013"
+               slowest_lap_time:
+                 type: timedelta
+               spread:
+                 type: timedelta
+               mean_lap_time:
+                 type: timedelta
+               median_lap_time:
+                 type: timedelta
+               stdev:
+                 type: timedelta
+               p10_lap_time:
+                 type: timedelta
+               p25_lap_time:
+                 type: timedelta
+               p75_lap_time:
+                 type: timedelta
+               p90_lap_time:
+                 type: timedelta
+          HistogramBin:
+            type: object
+            properties:
+               from_lap_time:
+                 type: timedelta
+                 example: "0:01:12.013"
+               to_lap_time:
+                 type: timedelta
+               drivers:
+                 type: string
+                 example: "3"
+          TeamStats:
+            type: object
+            properties:
+               name:
+                 type: string
+                 example: FERRARI
+               drivers:
+                 type: string
+                 example: "2"
+               best_lap_time:
+                 type: timedelta
+               average_lap_time:
+                 type: timedelta
+               stdev:
+                 type: timedelta
+               gap_to_leader:
+                 type: timedelta
+               gap_to_previous:
+                 type: timedelta
+          Stats:
+            type: object
+            properties:
+                stats:
+                    type: object
+                    properties:
+                        field:
+                            $ref: '#/definitions/FieldStats'
+                        histogram:
+                            type: array
+                            items:
+                                $ref: '#/definitions/HistogramBin'
+                        teams:
+                            type: array
+                            items:
+                                $ref: '#/definitions/TeamStats'
+
+        responses:
+         200:
+           description: Lap time statistics
+           schema:
+             $ref: '#/definitions/Stats'
+        """
+        set_response_format()
+        return {'stats': lap_statistics()}
+
+
+class SearchApi(Resource):
+    MAX_PAGE = 10000
+    MAX_PER_PAGE = 100
+
+    def get(self) -> dict:
+        """Return the drivers found by full-text search of name, abbreviation, team and biography, best match first.
+
+         ---
+        parameters:
+         - in: query
+           name: q
+           type: string
+           required: true
+           description: Words to search (each is matched as a prefix, all must match)
+           example: lewis merc
+         - in: query
+           name: page
+           type: integer
+           required: false
+           default: 1
+           maximum: 10000
+         - in: query
+           name: per_page
+           type: integer
+           required: false
+           default: 10
+           maximum: 100
+         - in: query
+           name: format
+           type: string
+           enum: ['json', 'xml', 'columns']
+           required: false
+           description: Specify which format the response will be in
+
+        definitions:
+          SearchResult:
+            type: object
+            properties:
+               name:
+                 type: string
+                 example: Lewis Hamilton
+               abbr:
+                 type: string
+                 example: LHM
+               team:
+                 type: string
+                 example: MERCEDES
+               snippet:
+                 type: string
+                 description: The best matching part of the indexed text, matches are enclosed in <b></b>
+                 example: "<b>Lewis</b> Hamilton"
+          Search:
+            type: object
+            properties:
+                search:
+                    type: object
+                    properties:
+                        total:
+                          type: string
+                        page:
+                          type: string
+                        per_page:
+                          type: string
+                        results:
+                            type: array
+                            items:
+                                $ref: '#/definitions/SearchResult'
+
+        responses:
+         200:
+           description: Found drivers
+           schema:
+             $ref: '#/definitions/Search'
+         400:
+            description: Query is empty or page parameters are invalid
+        """
+        set_response_format()
+
+        query = request.args.get('q', '')
+        if not query.strip():
+            return {'error': 'search query \'q\' is required'}, 400
+        try:
+            page = int(request.args.get('page', 1))
+            per_page = int(request.args.get('per_page', 10))
+        except ValueError:
+            page = per_page = 0
+        if not 0 < page <= self.MAX_PAGE or not 0 < per_page <= self.MAX_PER_PAGE:
+            return {'error': f'page must be from 1 to {self.MAX_PAGE}, '
+                             f'per_page must be from 1 to {self.MAX_PER_PAGE}'}, 400
+
+        total, rows = Driver.search(query, page, per_page)
+        results = {f'result{ind + 1}': row for ind, row in enumerate(rows)}
+        return {'search': {'total': str(total), 'page': str(page), 'per_page': str(per_page), 'results': results}}
+
+
+class TeamsListApi(Resource):
+    def get(self) -> dict:
+        """Return the teams list API (with rosters and lap times), teams in alphabetical order.
+
+         ---
+        parameters:
+         - in: query
+           name: format
+           type: string
+           enum: ['json', 'xml', 'columns']
+           required: false
+           description: Specify which format the response will be in
+
+        definitions:
+          TeamDriver:
+            type: object
+            properties:
+               name:
+                 type: string
+                 example: Sebastian Vettel
+               abbr:
+                 type: string
+                 example: SVF
+               best_lap_time:
+                 type: timedelta
+                 example: "0:01:04.415"
+          Team:
+            type: object
+            properties:
+               name:
+                 type: string
+                 example: FERRARI
+               drivers:
+                 type: array
+                 description: The drivers of the team, fastest first
+                 items:
+                   $ref: '#/definitions/TeamDriver'
+               best_lap_time:
+                 type: timedelta
+                 example: "0:01:04.415"
+               average_lap_time:
+                 type: timedelta
+                 example: "0:01:08.527"
+          Teams:
+            type: object
+            properties:
+                Teams:
+                    type: array
+                    items:
+                        $ref: '#/definitions/Team'
+
+        responses:
+         200:
+           description: All teams
+           schema:
+             $ref: '#/definitions/Teams'
+        """
+        set_response_format()
+
+        teams = Team.all()
+        return {'teams': {f'team{ind + 1}': team.team_info_dictionary() for ind, team in enumerate(teams)}}
+
+
+class TeamApi(Resource):
+    def get(self, team_name: str) -> dict:
+        """Return the info about one particular team API.
+
+         ---
+        parameters:
+         - in: path
+           name: team_name
+           type: string
+           required: true
+           description: team name (case insensitive)
+           example: ferrari
+         - in: query
+           name: format
+           type: string
+           enum: ['json', 'xml', 'columns']
+           required: false
+           description: Specify which format the response will be in
+        responses:
+         200:
+           description: Team
+           schema:
+             $ref: '#/definitions/Team'
+         404:
+            description: A team with the specified name was not found
+        """
+        set_response_format()
+
+        team = Team.get_by_name(team_name)
+        if team is None:
+            return {'error': f'team \'{team_name}\' not found'}, 404
+        return {'team': team.team_info_dictionary()}
+
+
+class ExportApi(Resource):
+    def get(self) -> "Response":
+        """Return the whole table (teams or drivers with timing) as a stream of csv or compact columnar chunks.
+
+         ---
+        parameters:
+         - in: query
+           name: table
+           type: string
+           enum: ['team', 'driver']
+           required: true
+         - in: query
+           name: format
+           type: string
+           enum: ['csv', 'columns']
+           required: false
+           default: csv
+           description: csv or gzip-compressed json lines, each line is a chunk of rows in column-oriented layout
+        produces:
+         - text/csv
+         - application/gzip
+        responses:
+         200:
+           description: Table data
+         400:
+            description: Unknown table or format
+        """
+        table = request.args.get('table')
+        fmt = request.args.get('format', 'csv')
+        if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS:
+            request.environ['HTTP_ACCEPT'] = FORMATS['json']
+            return {'error': f'table must be one of {list(EXPORT_TABLES)}, format one of {list(EXPORT_FORMATS)}'}, 400
+
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        return Response(stream_with_context(export_chunks(table, fmt)), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={table}.{extension}'})
@@ -6,22 +6,74 @@ Contains Flask views, registers API endpoints, swagger and parses CLI.
 
 import argparse
 import os.path
+import threading
 
 import werkzeug
 from flask import Flask, render_template, request, redirect, url_for, session
-from flasgger import Swagger
-from wikipedia import wikipedia
 
-from src.drivers import Driver
-from src.utils import wiki
-from src.api import CustomApi, DriverApi, DriversListApi, ReportApi
+from src.drivers import Driver, Quarantine
+from src.ingest import IngestSession
+from src.utils import wiki, format_wiki, compress_response, LRUCache, single_flight
+from src.api import (CustomApi, DriverApi, DriversListApi, ReportApi, StatsApi, SearchApi, TeamApi, TeamsListApi,
+                     ExportApi)
+from src.export import export_db
 import src.database as database
 
 app = Flask(__name__)
 app.secret_key = 'dev'
+app.config['PERSISTENT_DB'] = False
 
 api = CustomApi(app)
-swagger = Swagger(app)
+
+
+def init_swagger(app: Flask) -> None:
+    """Register swagger views (/apidocs/). Flasgger builds the apispec from the api docstrings on the first
+    /apispec_1.json request and caches it (in non-debug mode)"""
+    from flasgger import Swagger
+
+    Swagger(app)
+
+
+class InitOnFirstRequest:
+    """
+    WSGI middleware which calls init function once, just before the first request is dispatched.
+    Used to defer startup work (swagger) which is not needed by processes that never serve requests
+    (CLI rebuild, tests of the other modules)
+    """
+
+    def __init__(self, wsgi_app, init):
+        self.wsgi_app = wsgi_app
+        self._init = init
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self._init is not None:
+            with self._lock:
+                if self._init is not None:
+                    self._init()
+                    self._init = None
+        return self.wsgi_app(environ, start_response)
+
+
+app.wsgi_app = InitOnFirstRequest(app.wsgi_app, lambda: init_swagger(app))
+
+PAGE_CACHE_SIZE = 256
+page_cache = LRUCache(PAGE_CACHE_SIZE)
+
+
+def cached_page(cache_key: tuple, render) -> str:
+    """Return the rendered page from the cache. On a miss render it (once for all concurrent requests
+    of the same page, the others wait for it) and cache it"""
+    page = page_cache.get(cache_key)
+    if page is None:
+        page = single_flight.do(cache_key, lambda: _render_and_cache(cache_key, render))
+    return page
+
+
+def _render_and_cache(cache_key: tuple, render) -> str:
+    page = render()
+    page_cache.set(cache_key, page)
+    return page
 
 
 @app.route('/report', methods=['GET', 'POST'])
@@ -29,6 +81,7 @@ def common_report() -> "Response":
     """
     Show the report for all drivers.
     Sort and set the order switch based on url for the template. 
+    Rendered pages are cached by order and data version.
     """
     if request.args.get('order') == 'desc':
         asc_order = False
@@ -44,13 +97,20 @@ def common_report() -> "Response":
             session['report_desc_switch'] = False
             return redirect(url_for('common_report'))
 
+    # the page depends on the session switch only through the order, which is a part of the key
+    cache_key = ('report', asc_order, database.data_version())
+    return cached_page(cache_key, lambda: _render_report(asc_order))
+
+
+def _render_report(asc_order: bool) -> str:
+    """Render the report page in asc/desc order"""
     lines = Driver.print_report(asc=asc_order) if Driver.print_report() else []
     return render_template('report.html', lines=lines)
 
 
 @app.route('/drivers', methods=['GET', 'POST'])
 def list_drivers() -> "Response":
-    """Show ordered driver list or a specific driver """
+    """Show ordered driver list or a specific driver. Rendered pages are cached by driver/order and data version"""
     if request.method == 'POST':
         session['driver_desc_switch'] = request.form.get('desc_switch', False, bool)
         if not session['driver_desc_switch']:
@@ -59,17 +119,30 @@ def list_drivers() -> "Response":
             return redirect(url_for('list_drivers', order='desc'))
 
     driver_id = request.args.get('driver_id')
+    asc_order = False if request.args.get('order') == 'desc' else True
+    if not driver_id:
+        session['driver_desc_switch'] = not asc_order
+    # the order switch is shown only for the list, so the page depends on the session only through the order
+    cache_key = ('drivers', driver_id, asc_order if not driver_id else None, database.data_version())
+    return cached_page(cache_key, lambda: _render_drivers(driver_id, asc_order))
+
+
+def _render_drivers(driver_id: str, asc_order: bool) -> str:
+    """Render the drivers page: the list in asc/desc order or a specific driver with the info from wikipedia"""
     driver_info = ''
     if driver_id:
         drivers = Driver.get_by_id(driver_id)
         if drivers is not None:
             try:
-                driver_info = wiki(drivers[0].name)
-            except (TypeError, IndexError, wikipedia.PageError):
+                biography = drivers[0].biography
+                name = drivers[0].name
+                if biography:
+                    driver_info = format_wiki(biography)
+                else:
+                    driver_info = single_flight.do(('wiki', name), lambda: wiki(name))
+            except (TypeError, IndexError):
                 driver_info = None
     else:
-        asc_order = False if request.args.get('order') == 'desc' else True
-        session['driver_desc_switch'] = not asc_order
         drivers = Driver.all(asc=asc_order)
     return render_template('drivers.html', drivers=drivers, driver_info=driver_info)
 
@@ -91,31 +164,61 @@ def internal_error(error: werkzeug.exceptions) -> 'Response':
 
 @app.before_request
 def before_request() -> None:
-    """Open connection to db before any request. From Peewee docs"""
-    database.db.connect(reuse_if_open=True)
+    """Open connection to db before any request. From Peewee docs.
+    Serving workers (PERSISTENT_DB) keep one connection, which is reopened if the db file is replaced"""
+    if app.config['PERSISTENT_DB']:
+        database.connect_persistent()
+    else:
+        database.db.connect(reuse_if_open=True)
 
 
 @app.teardown_request
 def _db_close(exc) -> None:
-    """Close connection to db after request. From Peewee docs"""
-    if not database.db.is_closed():
+    """Close connection to db after request (unless it is persistent). From Peewee docs"""
+    if not app.config['PERSISTENT_DB'] and not database.db.is_closed():
         database.db.close()
 
 
+@app.after_request
+def _compress(response: "Response") -> "Response":
+    """Compress the response if the client accepts gzip or deflate encoding"""
+    return compress_response(response, request.accept_encodings)
+
+
 api.add_resource(DriversListApi, '/api/v1/drivers/')
 api.add_resource(DriverApi, '/api/v1/drivers/<driver_id>/')
 api.add_resource(ReportApi, '/api/v1/report/')
+api.add_resource(StatsApi, '/api/v1/stats/')
+api.add_resource(SearchApi, '/api/v1/search/')
+api.add_resource(TeamsListApi, '/api/v1/teams/')
+api.add_resource(TeamApi, '/api/v1/teams/<team_name>/')
+api.add_resource(ExportApi, '/api/v1/export/')
 
 parser = argparse.ArgumentParser('Drivers statistics and reports')
 parser.add_argument('-r', '--rebuild', action='store_true', help='Rebuild drivers database from data files')
 parser.add_argument('-v', '--verbose', action='store_true', help='Verbose mode')
+parser.add_argument('-q', '--quarantine', metavar='FILE', help='Write malformed records of data files to FILE')
+parser.add_argument('-e', '--export', metavar='DIR',
+                    help='Export database tables to DIR as csv and compact columnar files instead of running the app')
+parser.add_argument('-b', '--biographies', action='store_true',
+                    help='Fetch biographies of drivers from wikipedia on rebuild (stored and indexed for search)')
 
 if __name__ == '__main__':
     args = parser.parse_args()
     if args.rebuild or not os.path.exists(database.db.database):
-        Driver.build_report()
-        database.delete_old_db_file(verbose=args.verbose)
-        database.create_db_tables()
-        Driver.save_teams_to_db(database.Team, verbose=args.verbose)
-        Driver.save_drivers_to_db(database.Driver, database.Team, verbose=args.verbose)
-    app.run()
+        with Quarantine(args.quarantine) as quarantine:
+            ingest_session = IngestSession(quarantine=quarantine)
+            ingest_session.parse()
+        if quarantine.total or args.verbose:
+            print(quarantine.summary())
+        database.confirm_replace_db_file(verbose=args.verbose)
+        if args.biographies:
+            Driver.fetch_biographies(ingest_session.drivers, verbose=args.verbose)
+        print('Rebuilding database...')
+        with database.new_db_file(verbose=args.verbose) as new_db:
+            ingest_session.save(new_db, verbose=args.verbose)
+    if args.export:
+        with database.db:
+            export_db(args.export, verbose=args.verbose)
+    else:
+        app.run()
@@ -4,9 +4,15 @@ This module defines peewee ORM models for database and contains some utility fun
 
 import os
 import sys
+import tempfile
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+
 import peewee
+from playhouse.sqlite_ext import FTS5Model, SearchField
 
 DATABASE = '../data/racing.db'
+MMAP_SIZE = 256 * 1024 * 1024
 db = peewee.SqliteDatabase(DATABASE)
 
 
@@ -22,35 +28,149 @@ class Team(BaseModel):
     name = peewee.CharField(unique=True)
 
 
+# case-insensitive lookups of teams by name (compared with COLLATE NOCASE) are served by this index
+Team.add_index(Team.index(Team.name.collate('NOCASE'), name='team_name_nocase'))
+
+
 class Driver(BaseModel):
-    """Driver table with all info and foreign key to Team table"""
+    """Driver table with all info, foreign key to Team table and the driver info pre-rendered for api (json, xml)"""
     name = peewee.CharField(unique=True)
     abbr = peewee.CharField(unique=True)
     team = peewee.ForeignKeyField(Team, backref='drivers')
     start_time = peewee.CharField()
     stop_time = peewee.CharField()
     best_lap = peewee.CharField()
+    best_lap_ms = peewee.IntegerField(index=True)
+    json_fragment = peewee.TextField(default='')
+    xml_fragment = peewee.TextField(default='')
+    biography = peewee.TextField(null=True)
 
+    class Meta:
+        # team rosters and lap aggregates are grouped by team and read from this index only
+        indexes = (
+            (('team', 'best_lap_ms'), False),
+        )
 
-def create_db_tables(filename: str = DATABASE, db: peewee.SqliteDatabase = db) -> None:
-    """Create tables in db if db is not created yet"""
-    if os.path.exists(filename):
-        raise SystemExit('Error. Database file already exists. Use -r to rebuild database')
-    with db:
-        db.create_tables([Team, Driver])
 
+class DriverIndex(FTS5Model):
+    """Full-text search index (FTS5) of driver name, abbreviation, team name and biography. Rowid is Driver id"""
+    name = SearchField()
+    abbr = SearchField()
+    team = SearchField()
+    biography = SearchField()
+
+    class Meta:
+        database = db
 
-def delete_old_db_file(verbose: bool = False) -> None:
-    """Delete old db file if rebuilding db (on first start or by -r switch)"""
+
+class LapIndex(BaseModel):
+    """Best lap times of the ingested drivers, precomputed for range and percentile queries: sorted lap times
+    in milliseconds (packed as 32-bit little-endian integers) and their histogram (json). One row per ingest"""
+    laps = peewee.BlobField()
+    histogram = peewee.TextField()
+
+
+MODELS = [Team, Driver, DriverIndex, LapIndex]
+
+
+def confirm_replace_db_file(verbose: bool = False) -> None:
+    """Ask to replace old db file if rebuilding db (by -r switch). Exit if not confirmed"""
     if os.path.exists(db.database):
-        if not input('Delete old version file: ' + os.path.abspath(db.database) + '\n(y/n)? \n') == 'y':
+        if not input('Replace old version file: ' + os.path.abspath(db.database) + '\n(y/n)? \n') == 'y':
             print('Exiting')
             sys.exit(0)
-        else:
-            try:
-                os.remove(db.database)
-            except OSError as err:
-                print('Error deleting old db file.', err)
-                sys.exit(1)
-            if verbose:
-                print('Removed old db file:', os.path.abspath(db.database))
+        if verbose:
+            print('Old db file will be replaced:', os.path.abspath(db.database))
+
+
+def _remove_db_files(filename: str) -> None:
+    """Remove db file with its WAL and shared memory files"""
+    for path in (filename, filename + '-wal', filename + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@contextmanager
+def new_db_file(filename: str = DATABASE, verbose: bool = False) -> peewee.SqliteDatabase:
+    """Build a new db in a temporary file next to filename and atomically replace filename with it.
+
+    Yields the new db (in WAL mode) with created tables. Models are not bound to it: queries are executed on it
+    explicitly (see ingest.py), so several new dbs can be built concurrently.
+    On exit the new db is checked (integrity, foreign keys, non-empty Driver table, search and lap indexes),
+    moved out of WAL mode and renamed into place, so running servers never see a missing or half-filled db:
+    connections opened after the rename read the new file, already open ones finish with the old one.
+    If the context fails or the check fails the old file is kept and the temporary one is removed.
+    The temporary file name is unique, so overlapping rebuilds of one file do not clash (the last one wins)"""
+    fd, tmp_filename = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(filename) + '.',
+                                        dir=os.path.dirname(os.path.abspath(filename)))
+    os.close(fd)
+    # mkstemp creates the file readable by the owner only, the db keeps the permissions of the replaced file
+    os.chmod(tmp_filename, os.stat(filename).st_mode & 0o777 if os.path.exists(filename) else 0o644)
+    new_db = peewee.SqliteDatabase(tmp_filename, pragmas={'journal_mode': 'wal', 'synchronous': 'off'})
+    try:
+        # the schema managers create the tables on new_db without rebinding the models (which would be global)
+        for model in MODELS:
+            type(model._schema)(model, new_db).create_all()
+        yield new_db
+
+        errors = [row[0] for row in new_db.execute_sql('PRAGMA integrity_check') if row[0] != 'ok']
+        errors += [f'foreign key error in {row[0]}' for row in new_db.execute_sql('PRAGMA foreign_key_check')]
+        drivers_count = Driver.select().count(new_db)
+        if not drivers_count:
+            errors.append('no drivers saved')
+        if DriverIndex.select().count(new_db) != drivers_count:
+            errors.append('search index is out of sync')
+        if not LapIndex.select().count(new_db):
+            errors.append('lap index is missing')
+        if errors:
+            raise SystemExit('Error. New database is invalid: ' + '; '.join(errors))
+        new_db.execute_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+        new_db.execute_sql('PRAGMA journal_mode=delete')
+        new_db.close()
+        with open(tmp_filename, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+        if verbose:
+            print('New db file is in place:', os.path.abspath(filename))
+    finally:
+        if not new_db.is_closed():
+            new_db.close()
+        _remove_db_files(tmp_filename)
+
+
+def db_filename(db: peewee.SqliteDatabase = db) -> str:
+    """Return the file name of db (also if it is opened by uri like 'file:path?mode=ro')"""
+    if db.connect_params.get('uri') and db.database.startswith('file:'):
+        return unquote(db.database[len('file:'):].split('?')[0])
+    return db.database
+
+
+def data_version(db: peewee.SqliteDatabase = db) -> tuple:
+    """Return the version of the data as (inode, modification time) of the db file, or None if there is no file.
+    It changes whenever the db file is rebuilt or replaced, so it is used in cache keys"""
+    try:
+        stat = os.stat(db_filename(db))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def open_read_only(filename: str = DATABASE, db: peewee.SqliteDatabase = db) -> None:
+    """Re-initialize db to open filename read-only (for serving workers).
+    The file is memory-mapped (up to MMAP_SIZE), so the pages are shared by all workers through the OS page cache
+    instead of being copied into each connection's cache"""
+    if not db.is_closed():
+        db.close()
+    db.init('file:' + quote(os.path.abspath(filename)) + '?mode=ro', uri=True,
+            pragmas={'query_only': 1, 'mmap_size': MMAP_SIZE})
+
+
+def connect_persistent(db: peewee.SqliteDatabase = db) -> None:
+    """Open the connection of a long-lived worker or keep the open one (with its prepared statements).
+    If the db file was replaced since the connection was opened (rebuild), the connection is reopened,
+    so the worker switches to the new file between requests"""
+    version = data_version(db)
+    if not db.is_closed() and getattr(db, 'connected_version', None) != version:
+        db.close()
+    if db.connect(reuse_if_open=True):
+        db.connected_version = version
@@ -1,22 +1,87 @@
 """
-This module contains Driver class which parses data files, represents driver objects as instances of the class,
-builds the database and reads from it.
+This module contains Driver class which parses data files, represents driver objects as instances of the class
+and reads them from the database, and Quarantine class which collects the malformed records of data files.
+The database is built from parsed drivers by ingest.py module.
 
 Relies on database.py module with peewee models.
 Contains constants for data file names and path.
 """
 
 import os
+import re
+import json
 import datetime as dt
+from collections import Counter
 import peewee
-from peewee import ModelSelect
+from peewee import ModelSelect, fn
 import src.database as database
+from src.utils import wiki_content
 
 DATA_PATH = '../data'
 ABBR_FILE = 'abbreviations.txt'
 START_LOG_FILE = 'start.log'
 END_LOG_FILE = 'end.log'
 
+# the name may contain '_', the team is the last field
+ABBR_LINE = re.compile(r'([A-Z]{3})_(.+)_([^_]+)')
+LOG_LINE = re.compile(r'([A-Z]{3})\d{4}-\d{2}-\d{2}_(\d{2}):(\d{2}):(\d{2})\.(\d{3})')
+
+
+class Quarantine:
+    """
+    A class to collect the records of data files which are rejected by the parser.
+
+        Rejected records are counted by reason and, if filename is given, written to that file
+        (tab separated: file:line number, reason, record).
+
+        Attributes
+        ----------
+
+        filename : str
+            quarantine file name (or None to only count rejected records)
+        counts : Counter
+            number of rejected records by reason
+
+        Methods
+        -------
+        reject : None
+            Count the rejected record and write it to the quarantine file
+        summary : str
+            Return the pretty string with the counts of rejected records
+        close : None
+            Close the quarantine file
+        """
+
+    def __init__(self, filename: str = None):
+        self.filename = filename
+        self.counts = Counter()
+        self._file = open(filename, 'w', encoding='UTF-8') if filename else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def reject(self, source: str, line_no: int, record: str, reason: str) -> None:
+        self.counts[reason] += 1
+        if self._file is not None:
+            self._file.write(f'{source}:{line_no or "-"}\t{reason}\t{record.rstrip()}\n')
+
+    def summary(self) -> str:
+        lines = [f'{self.total} records quarantined' + (f' to {self.filename}' if self.filename else '')]
+        lines += [f'    {count:>8} {reason}' for reason, count in self.counts.most_common()]
+        return '\n'.join(lines)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
 
 class Driver:
     """
@@ -25,8 +90,6 @@ class Driver:
         Attributes
         ----------
 
-        _driver_list : list
-            list of driver objects
         abbr : str
             name abbreviation as in abbreviation file
         name : str
@@ -39,6 +102,8 @@ class Driver:
             finish time of the lap
         best_lap : timedelta
             time of the best lap
+        biography : str
+            text of the wikipedia page about the driver (if fetched on rebuild)
 
         Methods
         -------
@@ -51,6 +116,8 @@ class Driver:
                 Return the list of drivers from data files
             _parse_logs : list
                 Return the list of drivers with updated times from parsing of log files
+            _parse_log : None
+                Update one of the times of drivers from parsing of a log file
 
         print_report : str
             Return the statistics of all or one driver
@@ -58,18 +125,21 @@ class Driver:
             Return the list of driver objects
         get_by_id : list
             Return the list of one driver object (by id or name)
+        all_fragments : list
+            Return the list of pre-rendered (json or xml) driver info of all drivers
+        search : tuple
+            Return the total count and a page of drivers found by full-text search
         """
 
-    _driver_list = []
-
     def __init__(self, abbr=None, name=None, team=None, start_time=None, stop_time=None,
-                 best_lap=None):
+                 best_lap=None, biography=None):
         self.abbr = abbr
         self.name = name
         self.team = team
         self.start_time = start_time
         self.stop_time = stop_time
         self.best_lap = best_lap
+        self.biography = biography
 
     def __repr__(self):
         return f'Driver ({self.__dict__})'
@@ -80,58 +150,91 @@ class Driver:
         return '{:<20} | {:<25} | {}'.format(query_set.name, query_set.team.name, query_set.best_lap[:-3])
 
     @staticmethod
-    def _drivers_from_abbr(data_path: str = DATA_PATH, abbr_file=ABBR_FILE) -> list:
+    def _drivers_from_abbr(data_path: str = DATA_PATH, abbr_file=ABBR_FILE, quarantine: Quarantine = None) -> list:
         """
         Return the list of driver instances each with their name, abbreviation and team parsed from the
-        data_path/ABBR_FILE
+        data_path/ABBR_FILE. Malformed lines, repeated abbreviations and names are rejected to quarantine
         """
-        drivers = []
+        quarantine = quarantine or Quarantine()
+        drivers = {}
+        names = set()
         with open(os.path.join(data_path, abbr_file), 'r', encoding='UTF-8') as f:
-            for line in f:
-                abbr, name, team = line.split('_')
-                new_driver = Driver(abbr=abbr, name=name, team=team.rstrip())
-                drivers.append(new_driver)
-        return drivers
+            for line_no, line in enumerate(f, start=1):
+                match = ABBR_LINE.fullmatch(line.strip())
+                if match is None:
+                    if line.strip():
+                        quarantine.reject(abbr_file, line_no, line, 'malformed abbreviation line')
+                    continue
+                abbr, name, team = match.groups()
+                if abbr in drivers:
+                    quarantine.reject(abbr_file, line_no, line, 'duplicate abbreviation')
+                    continue
+                if name in names:
+                    quarantine.reject(abbr_file, line_no, line, 'duplicate name')
+                    continue
+                names.add(name)
+                drivers[abbr] = Driver(abbr=abbr, name=name, team=team)
+        return list(drivers.values())
 
     @staticmethod
-    def _parse_logs(drivers: list, data_path: str = DATA_PATH) -> list:
+    def _parse_log(drivers: dict, log_file: str, time_attr: str, data_path: str, quarantine: Quarantine) -> None:
+        """Set the time attribute of drivers (dict by abbreviation) from the log file in data_path"""
+        with open(os.path.join(data_path, log_file), 'r', encoding='UTF-8') as f:
+            for line_no, line in enumerate(f, start=1):
+                match = LOG_LINE.fullmatch(line.strip())
+                if match is None:
+                    if line.strip():
+                        quarantine.reject(log_file, line_no, line, 'malformed log line')
+                    continue
+                abbr, hours, minutes, seconds, milliseconds = match.groups()
+                driver = drivers.get(abbr)
+                if driver is None:
+                    quarantine.reject(log_file, line_no, line, 'unknown abbreviation')
+                elif getattr(driver, time_attr) is not None:
+                    quarantine.reject(log_file, line_no, line, 'duplicate log entry')
+                else:
+                    try:
+                        time = dt.datetime(1900, 1, 1, int(hours), int(minutes), int(seconds),
+                                           int(milliseconds) * 1000)
+                    except ValueError:
+                        quarantine.reject(log_file, line_no, line, 'invalid time')
+                        continue
+                    setattr(driver, time_attr, time)
+
+    @staticmethod
+    def _parse_logs(drivers: list, data_path: str = DATA_PATH, quarantine: Quarantine = None) -> list:
         """
         Return the copy of drivers list with updated start and finish times from the parsing of the logs
-        in 'data_path'
+        in 'data_path'. Malformed lines, unknown abbreviations and repeated entries are rejected to quarantine
         """
+        quarantine = quarantine or Quarantine()
         result_drivers = drivers[:]
-        with open(os.path.join(data_path, START_LOG_FILE), 'r', encoding='UTF-8') as f:
-            lines = (line for line in f if line.strip())
-            for line in lines:
-                abbr, start_time = line[:3], line.split('_')[1].rstrip()
-                for driver in result_drivers:
-                    if driver.abbr == abbr:
-                        driver.start_time = dt.datetime.strptime(start_time, "%H:%M:%S.%f")
-                        break
-        with open(os.path.join(data_path, END_LOG_FILE), 'r', encoding='UTF-8') as f:
-            lines = (line for line in f if line.strip())
-            for line in lines:
-                abbr, stop_time = line[:3], line.split('_')[1].rstrip()
-                for driver in result_drivers:
-                    if driver.abbr == abbr:
-                        driver.stop_time = dt.datetime.strptime(stop_time, "%H:%M:%S.%f")
-                        break
+        drivers_by_abbr = {driver.abbr: driver for driver in result_drivers}
+        Driver._parse_log(drivers_by_abbr, START_LOG_FILE, 'start_time', data_path, quarantine)
+        Driver._parse_log(drivers_by_abbr, END_LOG_FILE, 'stop_time', data_path, quarantine)
         return result_drivers
 
     @staticmethod
-    def build_report(data_path: str = DATA_PATH, abbr_file: str = ABBR_FILE) -> list:
+    def build_report(data_path: str = DATA_PATH, abbr_file: str = ABBR_FILE, quarantine: Quarantine = None) -> list:
         """
         Build the report based on files of name abbreviations and time logs in DATA_PATH. Calculate best lap time for
         each driver. Return the list of drivers.
+        Bad records (and drivers without start or finish time) are rejected to quarantine instead of failing the build
         """
-        drivers = Driver._drivers_from_abbr(data_path, abbr_file)
-        drivers = Driver._parse_logs(drivers, data_path)
+        quarantine = quarantine or Quarantine()
+        drivers = Driver._drivers_from_abbr(data_path, abbr_file, quarantine)
+        drivers = Driver._parse_logs(drivers, data_path, quarantine)
+        complete_drivers = []
         for driver in drivers:
+            if driver.start_time is None or driver.stop_time is None:
+                reason = 'missing start time' if driver.start_time is None else 'missing stop time'
+                quarantine.reject(abbr_file, None, f'{driver.abbr}_{driver.name}_{driver.team}', reason)
+                continue
             if driver.start_time > driver.stop_time:
                 driver.start_time, driver.stop_time = driver.stop_time, driver.start_time
             driver.best_lap = driver.stop_time - driver.start_time
-        Driver._driver_list = drivers
-        return drivers
+            complete_drivers.append(driver)
+        return complete_drivers
 
     @staticmethod
     def print_report(asc: bool = True) -> list:
@@ -143,7 +246,8 @@ class Driver:
         asc - ascending order if True
         """
 
-        drivers_qs = database.Driver.select().join(database.Team).order_by(database.Driver.best_lap)
+        drivers_qs = (database.Driver.select(database.Driver, database.Team).join(database.Team)
+                      .order_by(database.Driver.best_lap))
         res_table = ['{:2d}. '.format(i + 1) + Driver.statistics(driver) for i, driver in enumerate(drivers_qs)]
         if asc:
             res_table.insert(15, '-' * 60)
@@ -160,16 +264,22 @@ class Driver:
                       start_time=driver_query_set.start_time,
                       stop_time=driver_query_set.stop_time,
                       best_lap=driver_query_set.best_lap,
+                      biography=driver_query_set.biography,
                       )
 
     @staticmethod
-    def all(asc=True) -> list:
-        """Return the list of drivers objects taken from db in asc/desc order"""
+    def all(asc=True, by_best_lap: bool = False, limit: int = None) -> list:
+        """Return the list of drivers objects taken from db in asc/desc order of name
+        or in order of best lap time (all of them or the first limit drivers)"""
         driver_list = []
-        if asc:
-            query = database.Driver.select().join(database.Team).order_by(database.Driver.name)
+        # teams are selected with drivers, so their names are not queried for each driver
+        query = database.Driver.select(database.Driver, database.Team).join(database.Team)
+        if by_best_lap:
+            query = query.order_by(database.Driver.best_lap_ms, database.Driver.name).limit(limit)
+        elif asc:
+            query = query.order_by(database.Driver.name)
         else:
-            query = database.Driver.select().join(database.Team).order_by(database.Driver.name.desc())
+            query = query.order_by(database.Driver.name.desc())
 
         for d in query:
             driver_obj = Driver.create_driver_from_queryset(d)
@@ -180,7 +290,7 @@ class Driver:
     def get_by_id(driver_id: str) -> list:
         """Return the list with driver object by id or name. Return empty list if not found"""
         try:
-            driver_qs = database.Driver.select().join(database.Team).where(
+            driver_qs = database.Driver.select(database.Driver, database.Team).join(database.Team).where(
                 database.Driver.abbr.contains(driver_id) | database.Driver.name.contains(driver_id)
             ).get()
             driver = Driver.create_driver_from_queryset(driver_qs)
@@ -188,61 +298,73 @@ class Driver:
             return []
         return [driver]
 
+    @staticmethod
+    def all_fragments(fmt: str = 'json', by_best_lap: bool = False, limit: int = None) -> list:
+        """Return the list of pre-rendered info strings ('json' or 'xml' fragments) of all drivers
+        (or of the first limit drivers) in order of name or best lap time"""
+        field = database.Driver.xml_fragment if fmt == 'xml' else database.Driver.json_fragment
+        if by_best_lap:
+            query = database.Driver.select(field).order_by(database.Driver.best_lap_ms, database.Driver.name)
+        else:
+            query = database.Driver.select(field).order_by(database.Driver.name)
+        return [fragment for fragment, in query.limit(limit).tuples()]
+
+    @staticmethod
+    def search(query: str, page: int = 1, per_page: int = 10) -> tuple:
+        """Return the total count of drivers found by full-text search of name, abbreviation, team and biography
+        and the page of them (dicts with highlighted snippet) ordered by rank. Words of query are matched as prefixes
+        (all of them must match)"""
+        words = re.findall(r'\w+', query)
+        if not words:
+            return 0, []
+        index = database.DriverIndex
+        match = index.match(' '.join(f'"{word}"*' for word in words))
+        rank = index.bm25(10.0, 10.0, 5.0, 1.0)
+        snippet = fn.snippet(index._meta.entity, -1, '<b>', '</b>', '...', 16)
+        total = index.select().where(match).count()
+        rows = (index.select(index.name, index.abbr, index.team, snippet.alias('snippet'))
+                .where(match)
+                .order_by(rank)
+                .paginate(page, per_page)
+                .dicts())
+        return total, list(rows)
+
     def driver_info_dictionary(self) -> dict:
-        """Return the driver info as a dictionary. Used for api"""
+        """Return the driver info as a dictionary. Used for api.
+        Times can be either parsed (datetime, timedelta) or taken from db (strings)"""
         return {
             'name': self.name,
             'abbr': self.abbr,
             'team': self.team,
-            'start_time': self.start_time.split()[1][:-3],
-            'stop_time': self.stop_time.split()[1][:-3],
-            'best_lap_time': self.best_lap[:-3],
+            'start_time': str(self.start_time).split()[1][:-3],
+            'stop_time': str(self.stop_time).split()[1][:-3],
+            'best_lap_time': str(self.best_lap)[:-3],
         }
 
-    @staticmethod
-    def save_teams_to_db(team_table: 'Team', verbose=False) -> None:
-        """Save team names to a dedicated teams table in database"""
-        if not Driver._driver_list:
-            raise ValueError('Nothing to save to db. First parse the datafiles.')
+    def info_fragments(self) -> tuple:
+        """Return the driver info pre-rendered as json and xml fragments, exactly as they appear in api responses.
+        These are stored with the driver in db, so the list api responses are assembled by joining them"""
+        import xml.etree.ElementTree as ET
 
-        print('Rebuilding database...')
-        for d in Driver._driver_list:
-            try:
-                if verbose:
-                    print(f'Saving team {d.team}...')
-                team_table.create(name=d.team)
-            except peewee.IntegrityError:
-                if verbose:
-                    print(f'Team {d.team} is already in db')
-        if verbose:
-            print(f'{team_table.select().count()} teams saved to database.')
+        info = self.driver_info_dictionary()
+        json_fragment = json.dumps(info)
+        xml_elements = []
+        for key, value in info.items():
+            element = ET.Element(key)
+            element.text = value
+            xml_elements.append(ET.tostring(element, encoding='unicode'))
+        return json_fragment, ''.join(xml_elements)
 
     @staticmethod
-    def save_drivers_to_db(driver_table: 'Driver', team_table: 'Team', verbose=False) -> None:
-        """Save parsed drivers' detail to database and clean in-memory list of drivers.
-
-        Teams table must be populated beforehand"""
-
-        if not Driver._driver_list:
-            raise ValueError('Nothing to save to db. First parse the datafiles.')
-        if not team_table.select().count() > 0:
-            raise ValueError('Team table must be populated before Driver table')
+    def fetch_biographies(drivers: list, verbose=False) -> None:
+        """Fetch the biography of each driver from wikipedia (to be saved to db and search index by ingest session)"""
+        import requests
+        import wikipedia
 
-        for d in Driver._driver_list:
+        for d in drivers:
+            if verbose:
+                print(f'Fetching biography of {d.name}...')
             try:
-                if verbose:
-                    print(f'Saving driver details of {d.name}...')
-                driver_table.create(name=d.name,
-                                    abbr=d.abbr,
-                                    team=team_table.get(team_table.name == d.team),
-                                    start_time=d.start_time,
-                                    stop_time=d.stop_time,
-                                    best_lap=d.best_lap
-                                    )
-                if verbose:
-                    print(f'Driver details of {d.name} saved to database')
-            except peewee.IntegrityError:
-                print(f'Error during saving driver {d.name} to db')
-        Driver._driver_list = []
-        if verbose:
-            print(f'{driver_table.select().count()} drivers saved to database')
+                d.biography = wiki_content(d.name)
+            except (wikipedia.exceptions.WikipediaException, requests.RequestException) as err:
+                print(f'Error fetching biography of {d.name}:', err)
@@ -0,0 +1,76 @@
+"""
+This module exports the database tables (teams, drivers with their timing) in bulk for analysis.
+
+Two formats are produced as streams of chunks, so the memory stays flat at any table size:
+    - csv: header line and rows
+    - columns: gzip-compressed json lines, each line is a chunk of rows in column-oriented layout
+      ({"column": [values of the chunk rows], ..}), readable by any gzip/json tool
+Rows are read by iterating the db cursor without caching them in the query.
+"""
+
+import csv
+import io
+import itertools
+import json
+import os
+import zlib
+
+import src.database as database
+
+CHUNK_SIZE = 1000
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'columns': ('application/gzip', 'columns.jsonl.gz'),
+}
+EXPORT_TABLES = {
+    'team': (database.Team, ['id', 'name']),
+    'driver': (database.Driver, ['id', 'name', 'abbr', 'team', 'start_time', 'stop_time', 'best_lap', 'best_lap_ms']),
+}
+
+
+def iter_chunks(table: str, chunk_size: int = CHUNK_SIZE) -> tuple:
+    """Return column names of the table and the iterator of its rows chunks (lists of tuples) in id order"""
+    model, field_names = EXPORT_TABLES[table]
+    fields = [model._meta.fields[name] for name in field_names]
+    rows = model.select(*fields).order_by(model.id).tuples().iterator()
+    chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+    return [field.column_name for field in fields], chunks
+
+
+def csv_chunks(table: str, chunk_size: int = CHUNK_SIZE) -> 'Iterator[bytes]':
+    """Yield the table as csv (utf-8): the header, then chunks of rows"""
+    columns, chunks = iter_chunks(table, chunk_size)
+    for rows in itertools.chain([[columns]], chunks):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def columns_chunks(table: str, chunk_size: int = CHUNK_SIZE) -> 'Iterator[bytes]':
+    """Yield the table as gzip stream of json lines, each of them is a chunk of rows in column-oriented layout"""
+    columns, chunks = iter_chunks(table, chunk_size)
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for rows in chunks:
+        line = json.dumps(dict(zip(columns, map(list, zip(*rows))))) + '\n'
+        data = compressor.compress(line.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(table: str, fmt: str, chunk_size: int = CHUNK_SIZE) -> 'Iterator[bytes]':
+    """Yield the table in the format ('csv' or 'columns')"""
+    return csv_chunks(table, chunk_size) if fmt == 'csv' else columns_chunks(table, chunk_size)
+
+
+def export_db(path: str, verbose: bool = False) -> None:
+    """Export all tables in all formats to files in the path directory (table.csv, table.columns.jsonl.gz)"""
+    os.makedirs(path, exist_ok=True)
+    for table in EXPORT_TABLES:
+        for fmt, (_, extension) in EXPORT_FORMATS.items():
+            filename = os.path.join(path, f'{table}.{extension}')
+            with open(filename, 'wb') as f:
+                for chunk in export_chunks(table, fmt):
+                    f.write(chunk)
+            if verbose:
+                print(f'Exported {table} to {os.path.abspath(filename)}')
@@ -0,0 +1,114 @@
+"""
+This module contains IngestSession class which parses one set of data files and saves the parsed drivers
+(with their teams, search index and lap index) to a database.
+
+A session owns all its state, and its writes are executed on the database given explicitly, without rebinding
+the models. So several sessions can run concurrently (in threads or processes), each saving to its own database.
+"""
+
+import datetime as dt
+import json
+
+import peewee
+
+import src.database as database
+from src.drivers import Driver, Quarantine, DATA_PATH, ABBR_FILE
+from src.stats import lap_histogram, pack_laps
+
+INSERT_BATCH_SIZE = 50
+
+
+class IngestSession:
+    """
+    A class to represent an ingestion of data files into a database.
+
+        Attributes
+        ----------
+
+        data_path : str
+            directory with data files
+        abbr_file : str
+            name of the abbreviations file in data_path
+        quarantine : Quarantine
+            collects the records rejected by the parser
+        drivers : list
+            the parsed batch: driver objects with their times and best laps
+
+        Methods
+        -------
+        parse : list
+            Parse the data files into the batch of drivers and return it
+        save : None
+            Save the batch (teams, drivers, search index and lap index) to the database in one transaction
+        """
+
+    def __init__(self, data_path: str = DATA_PATH, abbr_file: str = ABBR_FILE, quarantine: Quarantine = None):
+        self.data_path = data_path
+        self.abbr_file = abbr_file
+        self.quarantine = quarantine or Quarantine()
+        self.drivers = []
+
+    def __repr__(self):
+        return f'IngestSession ({self.data_path}, {len(self.drivers)} drivers)'
+
+    def parse(self) -> list:
+        self.drivers = Driver.build_report(self.data_path, self.abbr_file, self.quarantine)
+        return self.drivers
+
+    def save(self, db: peewee.SqliteDatabase, verbose=False) -> None:
+        """Save the parsed drivers to db (its tables must exist) with bulk inserts in one transaction:
+        teams, then drivers with their pre-rendered fragments, then the search index built from them
+        and the lap index of their best laps"""
+        if not self.drivers:
+            raise ValueError('Nothing to save to db. First parse the datafiles.')
+
+        with db.atomic():
+            self._save_teams(db)
+            if verbose:
+                print(f'{database.Team.select().count(db)} teams saved to database')
+            self._save_drivers(db)
+            if verbose:
+                print(f'{database.Driver.select().count(db)} drivers saved to database')
+            self._save_search_index(db)
+            if verbose:
+                print(f'{database.DriverIndex.select().count(db)} drivers saved to search index')
+            self._save_lap_index(db)
+            if verbose:
+                print(f'{len(self.drivers)} lap times saved to lap index')
+
+    def _save_teams(self, db: peewee.SqliteDatabase) -> None:
+        teams = [{'name': team} for team in dict.fromkeys(d.team for d in self.drivers)]
+        for batch in peewee.chunked(teams, INSERT_BATCH_SIZE):
+            database.Team.insert_many(batch).on_conflict_ignore().execute(db)
+
+    def _save_drivers(self, db: peewee.SqliteDatabase) -> None:
+        team_ids = dict(database.Team.select(database.Team.name, database.Team.id).tuples().execute(db))
+        rows = []
+        for d in self.drivers:
+            json_fragment, xml_fragment = d.info_fragments()
+            rows.append({
+                'name': d.name,
+                'abbr': d.abbr,
+                'team': team_ids[d.team],
+                'start_time': d.start_time,
+                'stop_time': d.stop_time,
+                'best_lap': d.best_lap,
+                'best_lap_ms': d.best_lap // dt.timedelta(milliseconds=1),
+                'json_fragment': json_fragment,
+                'xml_fragment': xml_fragment,
+                'biography': d.biography,
+            })
+        for batch in peewee.chunked(rows, INSERT_BATCH_SIZE):
+            database.Driver.insert_many(batch).execute(db)
+
+    @staticmethod
+    def _save_search_index(db: peewee.SqliteDatabase) -> None:
+        driver, team, index = database.Driver, database.Team, database.DriverIndex
+        index.delete().execute(db)
+        query = driver.select(driver.id, driver.name, driver.abbr, team.name, driver.biography).join(team)
+        index.insert_from(query, [index.rowid, index.name, index.abbr, index.team, index.biography]).execute(db)
+
+    def _save_lap_index(self, db: peewee.SqliteDatabase) -> None:
+        sorted_laps = sorted(d.best_lap // dt.timedelta(milliseconds=1) for d in self.drivers)
+        database.LapIndex.insert(laps=pack_laps(sorted_laps),
+                                 histogram=json.dumps(lap_histogram(sorted_laps))).execute(db)
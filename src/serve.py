@@ -0,0 +1,136 @@
+"""
+Production serving entry point: pre-forks several worker processes which accept connections on one shared
+listening socket.
+
+The caches (rendered pages, lap statistics, apispec) are warmed in the master process before forking, so the
+workers share them copy-on-write. Each worker then opens its own read-only, memory-mapped connection to the db,
+keeps it open between requests and warms its prepared statements before accepting traffic: the queries of the
+cached pages and statistics are run directly, the others by requesting the api.
+Workers handle one request at a time, so the throughput scales with the number of workers (up to the cores).
+
+Relies on os.fork (Unix only). Run from the src directory: python serve.py -w 4 -p 8000
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+
+from werkzeug.serving import make_server
+
+from src.app import app
+from src.drivers import Driver
+from src.stats import load_lap_index, team_statistics
+from src.teams import Team
+import src.database as database
+
+WARM_UP_URLS = [
+    '/report',
+    '/report?order=desc',
+    '/drivers',
+    '/drivers?order=desc',
+    '/api/v1/drivers/',
+    '/api/v1/drivers/?format=xml',
+    '/api/v1/report/',
+    '/api/v1/report/?format=xml',
+    '/api/v1/stats/',
+    '/apispec_1.json',
+]
+
+
+def warm_up() -> None:
+    """Fill the caches and prepare the statements of the db connection by requesting the main pages and api"""
+    client = app.test_client()
+    for url in WARM_UP_URLS:
+        client.get(url)
+
+
+def warm_statements() -> None:
+    """Prepare the statements of the db connection by running the queries of the cached pages and statistics
+    (requests get them from the caches filled by the master, so warm_up does not run these queries)"""
+    Driver.print_report()
+    Driver.all(asc=True)
+    Driver.all(asc=False)
+    Team.all()
+    load_lap_index()
+    team_statistics(0)
+
+
+def prepare_worker(db_file: str) -> None:
+    """Open the worker's own read-only persistent db connection and warm its prepared statements.
+    The connection is opened as persistent before warming, so the requests keep it instead of reopening it"""
+    database.open_read_only(db_file)
+    app.config['PERSISTENT_DB'] = True
+    database.connect_persistent()
+    warm_statements()
+    warm_up()
+
+
+def run_worker(sock: socket.socket, db_file: str) -> None:
+    """Serve requests from the shared socket with own read-only persistent db connection"""
+    prepare_worker(db_file)
+    server = make_server(*sock.getsockname()[:2], app, fd=sock.fileno())
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server.serve_forever()
+
+
+def listen(host: str, port: int) -> socket.socket:
+    """Return the listening socket to be shared by the workers (port 0 binds a free one)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+    return sock
+
+
+def fork_workers(sock: socket.socket, db_file: str, workers: int) -> list:
+    """Warm the caches in this (master) process and fork the workers serving requests from the shared socket.
+    Return the list of worker pids"""
+    database.open_read_only(db_file)
+    warm_up()
+    database.db.close()
+
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock, db_file)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    return pids
+
+
+def serve(host: str, port: int, workers: int, db_file: str = database.DATABASE) -> None:
+    """Bind the socket, warm the caches and fork the workers. Stop the workers on SIGINT/SIGTERM"""
+    if not os.path.exists(db_file):
+        raise SystemExit('Error. Database file does not exist. Build it with app.py -r')
+    sock = listen(host, port)
+    children = fork_workers(sock, db_file, workers)
+    print(f'Serving on http://{host}:{sock.getsockname()[1]} with {workers} workers')
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+    sock.close()
+
+
+parser = argparse.ArgumentParser('Serve drivers statistics and reports with pre-forked workers')
+parser.add_argument('--host', default='127.0.0.1', help='Host to listen on')
+parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on')
+parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,182 @@
+"""
+This module computes lap time statistics of the whole field and of each team from the database.
+
+Team aggregates are computed by one grouped SQL query, field percentiles from the lap index: the sorted lap
+times and their histogram precomputed at ingest (see ingest.py). The lap index also answers the report filters
+(drivers within a gap to the leader, drivers up to a percentile) by binary search.
+Results are cached per data version, so they are computed once after each rebuild (concurrent requests
+on a cache miss share one computation).
+"""
+
+import bisect
+import json
+import math
+import statistics
+import sys
+from array import array
+
+from peewee import fn
+
+import src.database as database
+from src.utils import LRUCache, single_flight
+
+PERCENTILES = (10, 25, 75, 90)
+HISTOGRAM_BINS = 10
+stats_cache = LRUCache(16)
+
+
+def format_lap(ms: float) -> str:
+    """Format the lap time in milliseconds as in api responses (H:MM:SS.mmm)"""
+    seconds, ms = divmod(round(ms), 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}.{ms:03d}'
+
+
+def percentile(sorted_laps: list, p: float) -> float:
+    """Return the p-th percentile of sorted values (with linear interpolation between closest ranks)"""
+    position = (len(sorted_laps) - 1) * p / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_laps) - 1)
+    return sorted_laps[lower] + (sorted_laps[upper] - sorted_laps[lower]) * (position - lower)
+
+
+def field_statistics(sorted_laps: list) -> dict:
+    """Return the statistics of best lap times (sorted, in milliseconds) of all drivers"""
+    if not sorted_laps:
+        return {'drivers': '0'}
+    result = {
+        'drivers': str(len(sorted_laps)),
+        'fastest_lap_time': format_lap(sorted_laps[0]),
+        'slowest_lap_time': format_lap(sorted_laps[-1]),
+        'spread': format_lap(sorted_laps[-1] - sorted_laps[0]),
+        'mean_lap_time': format_lap(statistics.fmean(sorted_laps)),
+        'median_lap_time': format_lap(statistics.median(sorted_laps)),
+        'stdev': format_lap(statistics.pstdev(sorted_laps)),
+    }
+    for p in PERCENTILES:
+        result[f'p{p}_lap_time'] = format_lap(percentile(sorted_laps, p))
+    return result
+
+
+def pack_laps(sorted_laps: list) -> bytes:
+    """Pack lap times (in milliseconds) as 32-bit little-endian integers"""
+    laps = array('i', sorted_laps)
+    if sys.byteorder == 'big':
+        laps.byteswap()
+    return laps.tobytes()
+
+
+def unpack_laps(data: bytes) -> array:
+    """Unpack lap times packed by pack_laps"""
+    laps = array('i')
+    laps.frombytes(data)
+    if sys.byteorder == 'big':
+        laps.byteswap()
+    return laps
+
+
+def lap_histogram(sorted_laps: list, bins: int = HISTOGRAM_BINS) -> dict:
+    """Return the histogram of lap times (sorted, in milliseconds): bins of equal width (whole milliseconds)
+    from the fastest lap, counts of laps in each bin"""
+    if not sorted_laps:
+        return {'start_ms': 0, 'bin_ms': 0, 'counts': []}
+    start = sorted_laps[0]
+    width = max(math.ceil((sorted_laps[-1] - start + 1) / bins), 1)
+    counts = [0] * bins
+    for lap in sorted_laps:
+        counts[(lap - start) // width] += 1
+    return {'start_ms': start, 'bin_ms': width, 'counts': counts}
+
+
+def histogram_statistics(histogram: dict) -> dict:
+    """Return the histogram as api entries (bin1, bin2 ..) with the lap time range and the number of drivers"""
+    start, width = histogram['start_ms'], histogram['bin_ms']
+    return {f'bin{ind + 1}': {'from_lap_time': format_lap(start + ind * width),
+                              'to_lap_time': format_lap(start + (ind + 1) * width),
+                              'drivers': str(count)}
+            for ind, count in enumerate(histogram['counts'])}
+
+
+def team_statistics(leader_ms: int) -> dict:
+    """Return the statistics of best lap times of the drivers of each team, fastest team first.
+    Gaps are to the fastest driver of the field and to the previous team"""
+    lap = database.Driver.best_lap_ms
+    query = (database.Team
+             .select(database.Team.name, fn.COUNT(database.Driver.id), fn.MIN(lap), fn.AVG(lap), fn.AVG(lap * lap))
+             .join(database.Driver)
+             .group_by(database.Team.id)
+             .order_by(fn.MIN(lap), database.Team.name)
+             .tuples())
+    teams = {}
+    previous_best = leader_ms
+    for ind, (name, count, best, average, average_square) in enumerate(query):
+        teams[f'team{ind + 1}'] = {
+            'name': name,
+            'drivers': str(count),
+            'best_lap_time': format_lap(best),
+            'average_lap_time': format_lap(average),
+            'stdev': format_lap(math.sqrt(max(average_square - average * average, 0))),
+            'gap_to_leader': format_lap(best - leader_ms),
+            'gap_to_previous': format_lap(best - previous_best),
+        }
+        previous_best = best
+    return teams
+
+
+def lap_index() -> tuple:
+    """Return the sorted lap times (array of milliseconds) and their histogram. Cached per data version of the
+    bound db file. Computed from the Driver table if the db has no lap index"""
+    version = database.data_version(database.Driver._meta.database)
+    cache_key = ('lap index', version)
+    result = stats_cache.get(cache_key)
+    if result is None:
+        result = single_flight.do(cache_key, lambda: load_lap_index(cache_key if version is not None else None))
+    return result
+
+
+def load_lap_index(cache_key: tuple = None) -> tuple:
+    """Read the sorted lap times and their histogram from the bound db, cache them by cache_key if given"""
+    row = database.LapIndex.select().order_by(database.LapIndex.id.desc()).first()
+    if row is not None:
+        result = unpack_laps(bytes(row.laps)), json.loads(row.histogram)
+    else:
+        lap = database.Driver.best_lap_ms
+        sorted_laps = array('i', (ms for ms, in database.Driver.select(lap).order_by(lap).tuples()))
+        result = sorted_laps, lap_histogram(sorted_laps)
+    if cache_key is not None:
+        stats_cache.set(cache_key, result)
+    return result
+
+
+def count_within(within_ms: int) -> int:
+    """Return the number of drivers with the best lap within within_ms of the fastest one (binary search)"""
+    sorted_laps, _ = lap_index()
+    return bisect.bisect_right(sorted_laps, sorted_laps[0] + within_ms) if sorted_laps else 0
+
+
+def count_percentile(p: float) -> int:
+    """Return the number of drivers with the best lap up to the p-th percentile of the field (binary search)"""
+    sorted_laps, _ = lap_index()
+    return bisect.bisect_right(sorted_laps, percentile(sorted_laps, p)) if sorted_laps else 0
+
+
+def lap_statistics() -> dict:
+    """Return the field and team statistics of best lap times. Cached per data version of the bound db file"""
+    cache_key = database.data_version(database.Driver._meta.database)
+    result = stats_cache.get(cache_key)
+    if result is None:
+        result = single_flight.do(('stats', cache_key), lambda: _compute_lap_statistics(cache_key))
+    return result
+
+
+def _compute_lap_statistics(cache_key: tuple) -> dict:
+    sorted_laps, histogram = lap_index()
+    result = {
+        'field': field_statistics(sorted_laps),
+        'histogram': histogram_statistics(histogram),
+        'teams': team_statistics(sorted_laps[0]) if sorted_laps else {},
+    }
+    if cache_key is not None:
+        stats_cache.set(cache_key, result)
+    return result
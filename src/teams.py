@@ -0,0 +1,94 @@
+"""
+This module contains Team class which represents teams (with their rosters and lap times) read from the database.
+
+Relies on database.py module with peewee models. Each method reads all it needs by one query grouped by team.
+"""
+
+import json
+
+from peewee import fn
+
+import src.database as database
+from src.stats import format_lap
+
+
+class Team:
+    """
+    A class to represent a team.
+
+        Attributes
+        ----------
+
+        name : str
+            team name
+        drivers : list
+            roster: dicts with name, abbr and best_lap_ms of the team's drivers, fastest first
+        best_lap_ms : int
+            the best lap time of the team's drivers (milliseconds)
+        average_lap_ms : float
+            the average of best lap times of the team's drivers (milliseconds)
+
+        Methods
+        -------
+        all : list
+            Return the list of team objects
+        get_by_name : Team
+            Return the team object by name (case insensitive) or None
+        team_info_dictionary : dict
+            Return the team info as a dictionary
+        """
+
+    def __init__(self, name=None, drivers=None, best_lap_ms=None, average_lap_ms=None):
+        self.name = name
+        self.drivers = drivers or []
+        self.best_lap_ms = best_lap_ms
+        self.average_lap_ms = average_lap_ms
+
+    def __repr__(self):
+        return f'Team ({self.__dict__})'
+
+    @staticmethod
+    def _query() -> 'ModelSelect':
+        """Return the query of teams with their rosters (json array) and lap aggregates, grouped by team"""
+        driver = database.Driver
+        roster = fn.json_group_array(fn.json_object('name', driver.name, 'abbr', driver.abbr,
+                                                    'best_lap_ms', driver.best_lap_ms))
+        return (database.Team
+                .select(database.Team.name, roster, fn.MIN(driver.best_lap_ms), fn.AVG(driver.best_lap_ms))
+                .join(driver)
+                .group_by(database.Team.id))
+
+    @staticmethod
+    def _create_team_from_row(row: tuple) -> 'Team':
+        """Create team object from the row of the grouped query"""
+        name, roster, best_lap_ms, average_lap_ms = row
+        drivers = sorted(json.loads(roster), key=lambda d: (d['best_lap_ms'], d['name']))
+        return Team(name=name, drivers=drivers, best_lap_ms=best_lap_ms, average_lap_ms=average_lap_ms)
+
+    @staticmethod
+    def all() -> list:
+        """Return the list of team objects taken from db in alphabetical order"""
+        query = Team._query().order_by(database.Team.name).tuples()
+        return [Team._create_team_from_row(row) for row in query]
+
+    @staticmethod
+    def get_by_name(name: str) -> 'Team':
+        """Return the team object by name (case insensitive for ASCII letters). Return None if not found"""
+        query = Team._query().where(database.Team.name.collate('NOCASE') == name).tuples()
+        rows = list(query)
+        return Team._create_team_from_row(rows[0]) if rows else None
+
+    def team_info_dictionary(self) -> dict:
+        """Return the team info as a dictionary. Used for api"""
+        return {
+            'name': self.name,
+            'drivers': {
+                f'driver{ind + 1}': {
+                    'name': d['name'],
+                    'abbr': d['abbr'],
+                    'best_lap_time': format_lap(d['best_lap_ms']),
+                } for ind, d in enumerate(self.drivers)
+            },
+            'best_lap_time': format_lap(self.best_lap_ms),
+            'average_lap_time': format_lap(self.average_lap_ms),
+        }
@@ -1,14 +1,141 @@
 """
-Additional utils such as wikipedia info.
+Additional utils such as wikipedia info, response compression, LRU cache and request coalescing.
 """
 
-import wikipedia
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
 import re
 
+COMPRESS_MIN_SIZE = 500
+COMPRESS_LEVEL = 6
+COMPRESSORS = {
+    'gzip': lambda data: gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0),
+    'deflate': lambda data: zlib.compress(data, COMPRESS_LEVEL),
+}
+
+
+def wiki_content(driver_name: str) -> str:
+    """Return the plain text of the wikipedia page about driver or None if there is no such page.
+    wikipedia package (with requests and BeautifulSoup) is imported on the first call, not at startup"""
+    import wikipedia
+
+    try:
+        return wikipedia.page(driver_name).content
+    except wikipedia.PageError:
+        return None
+
+
+def format_wiki(wiki_text: str) -> str:
+    """Return wikipedia text with headings enclosed by '===' replaced by bold text"""
+    return re.sub(r'=+\s*(.*?)\s*=+', r'<b>\1</b>', wiki_text)
+
 
 def wiki(driver_name: str) -> str:
-    """Return the info about driver from wikipedia.
-    Original text returns with headings enclosed by '==='. This is replaced by bold text"""
-    wiki_text = wikipedia.page(driver_name).content
-    wiki_text_with_formatted_headings = re.sub(r'=+\s*(.*?)\s*=+', r'<b>\1</b>', wiki_text)
-    return wiki_text_with_formatted_headings
+    """Return the info about driver from wikipedia (formatted) or None if there is no such page"""
+    wiki_text = wiki_content(driver_name)
+    return format_wiki(wiki_text) if wiki_text is not None else None
+
+
+def compress_response(response: "Response", accept_encodings: "Accept") -> "Response":
+    """Compress the response body with the best encoding accepted by the client (gzip or deflate).
+    Small bodies (less than COMPRESS_MIN_SIZE bytes), streamed and already encoded responses are left as they are"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = accept_encodings.best_match(list(COMPRESSORS))
+    if encoding is None:
+        return response
+    response.set_data(COMPRESSORS[encoding](data))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class LRUCache:
+    """
+    Thread-safe cache which keeps at most maxsize entries and evicts the least recently used one.
+
+        Methods
+        -------
+        get : object
+            Return the cached value or default (and mark the key as recently used)
+        set : None
+            Store the value, evicting the least recently used entry if the cache is full
+        clear : None
+            Remove all entries
+        """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self._entries[key]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical computations: the first caller for a key computes the value,
+    the callers coming while it is in flight wait for it and share its result (or exception).
+    Nothing is kept after the computation is finished (use a cache for that).
+
+        Methods
+        -------
+        do : object
+            Return the result of func() computed once for all concurrent callers with the same key
+        """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            result = func()
+        except BaseException as err:
+            call.set_exception(err)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+single_flight = SingleFlight()
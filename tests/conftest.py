@@ -6,7 +6,7 @@ from flask import template_rendered
 import peewee
 
 from src.drivers import Driver
-from src.app import app
+from src.app import app, page_cache
 import src.database as database
 
 # test data files
@@ -24,8 +24,9 @@ TEST_DB = pathlib.Path(DATA_PATH) / 'test_racing.db'
 
 @pytest.fixture
 def client():
-    """Client used for testing"""
+    """Client used for testing. Rendered pages are not cached between tests"""
     app.testing = True
+    page_cache.clear()
     return app.test_client()
 
 
@@ -54,7 +55,7 @@ def captured_templates(app):
 def test_db_ctx():
     """Bind all models queries to test db (tests/test_racing.db) instead of the main one"""
     db = peewee.SqliteDatabase(TEST_DB)
-    ctx = db.bind_ctx([database.Team, database.Driver])
+    ctx = db.bind_ctx(database.MODELS)
     db.connect(reuse_if_open=True)
     yield ctx
     db.close()
@@ -64,7 +65,7 @@ def test_db_ctx():
 def empty_db():
     """Create in-memory db and bind existing models to it"""
     db = peewee.SqliteDatabase(':memory:')
-    models = [database.Team, database.Driver]
+    models = database.MODELS
     db.bind(models)
     db.create_tables(models)
     db.connect(reuse_if_open=True)
@@ -1,4 +1,6 @@
+import gzip
 import json
+import zlib
 from xml.etree import ElementTree as ET
 
 
@@ -82,3 +84,158 @@ def test_driver_search_success(build_report, client):
 def test_driver_search_not_found(build_report, client):
     r = client.get('/api/v1/drivers/unknown_driver/')
     assert r.status_code == 404
+
+
+def test_report_format_columns(build_report, client):
+    r = client.get('/api/v1/report/?format=columns')
+    assert r.content_type == "application/vnd.racing.columns+json"
+    columns = json.loads(r.data.decode('utf-8'))['report']
+    assert set(columns) == {'name', 'abbr', 'team', 'start_time', 'stop_time', 'best_lap_time'}
+    assert all(len(column) == 19 for column in columns.values())
+
+
+def test_driver_format_columns(build_report, client):
+    r = client.get('/api/v1/drivers/ham/?format=columns')
+    assert json.loads(r.data.decode('utf-8'))['driver']['name'] == 'Lewis Hamilton'
+
+
+def test_report_gzip(build_report, client):
+    plain = client.get('/api/v1/report/')
+    r = client.get('/api/v1/report/', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in r.headers['Vary']
+    assert gzip.decompress(r.data) == plain.data
+
+
+def test_report_deflate(build_report, client):
+    plain = client.get('/api/v1/report/')
+    r = client.get('/api/v1/report/', headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+    assert r.headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(r.data) == plain.data
+
+
+def test_small_response_not_compressed(build_report, client):
+    r = client.get('/api/v1/drivers/unknown_driver/', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in r.headers
+
+
+def test_drivers_list_data_xml(build_report, client):
+    r = client.get('/api/v1/drivers/?format=xml')
+    xml_tree = ET.fromstring(r.data.decode('utf-8'))
+    assert xml_tree.tag == 'drivers'
+    assert [d.tag for d in xml_tree.findall('./')][:2] == ['driver1', 'driver2']
+    assert xml_tree.find('driver1/name').text == 'Brendon Hartley'
+
+
+def test_stats_data_json(build_report, client):
+    r = client.get('/api/v1/stats/')
+    stats = json.loads(r.data.decode('utf-8'))['stats']
+    assert stats['field']['drivers'] == '19'
+    assert stats['field']['fastest_lap_time'] == stats['teams']['team1']['best_lap_time']
+    assert stats['histogram']['bin1']['from_lap_time'] == stats['field']['fastest_lap_time']
+    assert sum(int(b['drivers']) for b in stats['histogram'].values()) == 19
+
+
+def test_stats_format_columns(build_report, client):
+    r = client.get('/api/v1/stats/?format=columns')
+    teams = json.loads(r.data.decode('utf-8'))['stats']['teams']
+    assert len(teams['name']) == 10
+
+
+def test_search_data_json(build_report, client):
+    r = client.get('/api/v1/search/?q=lewis')
+    search = json.loads(r.data.decode('utf-8'))['search']
+    assert search['total'] == '1'
+    assert search['results']['result1']['name'] == 'Lewis Hamilton'
+    assert search['results']['result1']['snippet'] == '<b>Lewis</b> Hamilton'
+
+
+def test_search_data_xml(build_report, client):
+    r = client.get('/api/v1/search/?q=ferrari&per_page=2&format=xml')
+    xml_tree = ET.fromstring(r.data.decode('utf-8'))
+    assert xml_tree.find('total').text == '6'
+    assert len(xml_tree.findall('results/*')) == 2
+
+
+def test_search_bad_request(build_report, client):
+    assert client.get('/api/v1/search/').status_code == 400
+    assert client.get('/api/v1/search/?q=ham&per_page=1000').status_code == 400
+    for paging in ('page=abc', 'per_page=abc', 'page=99999999999999999999', 'page=0'):
+        assert client.get('/api/v1/search/?q=ham&' + paging).status_code == 400
+    r = client.get('/api/v1/search/?q=ham&page=abc&format=xml')
+    assert r.status_code == 400
+    assert ET.fromstring(r.data.decode('utf-8')).tag == 'error'
+
+
+def test_search_not_found_xml(build_report, client):
+    r = client.get('/api/v1/search/?q=zzz&format=xml')
+    assert r.status_code == 200
+    xml_tree = ET.fromstring(r.data.decode('utf-8'))
+    assert xml_tree.find('total').text == '0'
+    assert xml_tree.find('results') is not None
+    assert len(xml_tree.findall('results/*')) == 0
+
+
+def test_teams_list_data(build_report, client):
+    r = client.get('/api/v1/teams/')
+    teams = json.loads(r.data.decode('utf-8'))['teams']
+    assert len(teams) == 10
+    assert sum(len(team['drivers']) for team in teams.values()) == 19
+
+
+def test_team_data_xml(build_report, client):
+    r = client.get('/api/v1/teams/red bull racing tag heuer/?format=xml')
+    xml_tree = ET.fromstring(r.data.decode('utf-8'))
+    assert xml_tree.tag == 'team'
+    assert xml_tree.find('name').text == 'RED BULL RACING TAG HEUER'
+    assert [d.find('abbr').text for d in xml_tree.findall('drivers/*')] == ['DRR']
+
+
+def test_team_not_found(build_report, client):
+    r = client.get('/api/v1/teams/unknown_team/')
+    assert r.status_code == 404
+
+
+def test_export_csv(build_report, client):
+    r = client.get('/api/v1/export/?table=driver', headers={'Accept-Encoding': 'gzip'})
+    assert r.content_type.startswith('text/csv')
+    assert r.is_streamed and 'Content-Encoding' not in r.headers
+    lines = r.data.decode('utf-8').splitlines()
+    assert lines[0].startswith('id,name,abbr,team_id')
+    assert len(lines) == 20
+
+
+def test_export_columns(build_report, client):
+    r = client.get('/api/v1/export/?table=team&format=columns')
+    assert r.content_type == 'application/gzip'
+    assert len(json.loads(gzip.decompress(r.data))['name']) == 10
+
+
+def test_export_bad_request(build_report, client):
+    assert client.get('/api/v1/export/?table=unknown').status_code == 400
+    assert client.get('/api/v1/export/?table=team&format=xml').status_code == 400
+
+
+def test_report_within_ms(build_report, client):
+    r = client.get('/api/v1/report/?within_ms=1000')
+    report = json.loads(r.data.decode('utf-8'))['report']
+    assert list(report) == ['place1']
+    r = client.get('/api/v1/report/?within_ms=1000000&format=xml')
+    assert len(ET.fromstring(r.data.decode('utf-8')).findall('./')) == 19
+
+
+def test_report_percentile(build_report, client):
+    full = json.loads(client.get('/api/v1/report/').data.decode('utf-8'))['report']
+    r = client.get('/api/v1/report/?percentile=25')
+    report = json.loads(r.data.decode('utf-8'))['report']
+    assert report == {place: full[place] for place in list(full)[:5]}
+    r = client.get('/api/v1/report/?format=columns')
+    assert json.loads(r.data.decode('utf-8'))['report']['abbr'] == [place['abbr'] for place in full.values()]
+    r = client.get('/api/v1/report/?percentile=25&within_ms=1000&format=columns')
+    assert json.loads(r.data.decode('utf-8'))['report']['abbr'] == ['SVF']
+
+
+def test_report_filters_invalid(build_report, client):
+    for query in ('within_ms=-1', 'within_ms=fast', 'percentile=101', 'percentile=nan'):
+        r = client.get('/api/v1/report/?' + query)
+        assert r.status_code == 400
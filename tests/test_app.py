@@ -1,3 +1,8 @@
+import os
+import shutil
+import subprocess
+import sys
+
 from flask import session
 
 from src.app import app
@@ -88,3 +93,57 @@ def test_report_context(build_report, client):
         assert template.name == 'report.html'
         assert response.status_code == 200
         assert len(context['lines']) == 19 or 20
+
+
+def test_report_page_cached(build_report, client):
+    """Test that the rendered report is cached per order and template is not rendered again"""
+    first = client.get('/report?order=desc')
+    with captured_templates(app) as templates:
+        second = client.get('/report?order=desc')
+        assert templates == []
+    assert first.data == second.data
+    with captured_templates(app) as templates:
+        client.get('/report')
+        assert len(templates) == 1
+
+
+def test_drivers_page_cached_keeps_session_switch(build_report, client):
+    """Test that a cached drivers page still sets the order switch in session"""
+    client.get('/drivers?order=desc')
+    with client as c:
+        c.get('/drivers')
+        c.get('/drivers?order=desc')
+        assert session['driver_desc_switch'] is True
+
+
+def test_import_defers_heavy_dependencies():
+    """Test that importing the app does not import swagger, wikipedia and xml machinery (fresh interpreter)"""
+    code = 'import sys, src.app; print([m for m in ("flasgger", "wikipedia", "xml.etree") if m in sys.modules])'
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[]'
+
+
+def test_swagger_registered_on_first_request(client):
+    """Test that swagger views are available although they are registered lazily"""
+    response = client.get('/apispec_1.json')
+    assert response.status_code == 200
+    assert '/api/v1/report/' in response.json['paths']
+
+
+def test_main_rebuild_then_serve_report(tmp_path):
+    """Test that the app serves pages after rebuilding the db in __main__ (run in a fresh interpreter, in a copy
+    of the project layout, so the db is built from the test data files in tmp_path/data)"""
+    shutil.copytree(os.path.join(os.path.dirname(__file__), 'test_data'), tmp_path / 'data',
+                    ignore=shutil.ignore_patterns('*.db'))
+    # the app run as __main__ finds its templates in the working directory
+    shutil.copytree(os.path.join(app.root_path, 'templates'), tmp_path / 'src' / 'templates')
+    code = ('import runpy, sys, flask; '
+            'flask.Flask.run = lambda self, *args, **kwargs: print(self.test_client().get("/report").status_code); '
+            'sys.argv = ["app.py", "-r"]; '
+            'runpy.run_module("src.app", run_name="__main__")')
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(map(os.path.abspath, sys.path)))
+    result = subprocess.run([sys.executable, '-c', code], env=env, cwd=tmp_path / 'src', capture_output=True,
+                            text=True, check=True)
+    assert result.stdout.splitlines()[-1] == '200'
+    assert (tmp_path / 'data' / 'racing.db').exists()
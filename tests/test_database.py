@@ -0,0 +1,125 @@
+import os
+
+import peewee
+import pytest
+
+import src.database as database
+from src.ingest import IngestSession
+from .conftest import DATA_PATH
+
+
+def save_report(db):
+    session = IngestSession(data_path=DATA_PATH)
+    session.parse()
+    session.save(db)
+
+
+def test_new_db_file(tmp_path):
+    """Test that the new db is built (models stay bound to the main db) and put in place, temporary files are removed"""
+    filename = str(tmp_path / 'racing.db')
+    with database.new_db_file(filename) as new_db:
+        assert all(model._meta.database is database.db for model in database.MODELS)
+        assert set(new_db.get_tables()) >= {model._meta.table_name for model in database.MODELS}
+        save_report(new_db)
+    assert os.listdir(tmp_path) == ['racing.db']
+    new_db = peewee.SqliteDatabase(filename)
+    with new_db.bind_ctx([database.Team, database.Driver]):
+        assert database.Driver.select().count() == 19
+        assert new_db.execute_sql('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    new_db.close()
+
+
+def test_new_db_file_replaces_old_file(tmp_path):
+    """Test that the old db file is replaced and already open connection still reads the old data"""
+    filename = str(tmp_path / 'racing.db')
+    old_db = peewee.SqliteDatabase(filename)
+    old_db.execute_sql('CREATE TABLE old (id INTEGER)')
+    old_version = database.data_version(old_db)
+    with database.new_db_file(filename) as new_db:
+        save_report(new_db)
+    assert old_db.execute_sql('SELECT count(*) FROM old').fetchone()[0] == 0
+    old_db.close()
+    assert database.data_version(old_db) != old_version
+    with pytest.raises(peewee.OperationalError):
+        old_db.execute_sql('SELECT count(*) FROM old')
+    old_db.close()
+
+
+def test_new_db_file_invalid_keeps_old_file(tmp_path):
+    """Test that the old db file is kept if nothing is saved to the new one"""
+    filename = tmp_path / 'racing.db'
+    filename.write_bytes(b'')
+    with pytest.raises(SystemExit):
+        with database.new_db_file(str(filename)):
+            pass
+    assert os.listdir(tmp_path) == ['racing.db']
+
+
+def test_open_read_only(tmp_path):
+    """Test that db opened read-only can be read, but not written, and its data version is of the file"""
+    filename = str(tmp_path / 'racing.db')
+    with database.new_db_file(filename) as new_db:
+        save_report(new_db)
+    ro_db = peewee.SqliteDatabase(None)
+    database.open_read_only(filename, db=ro_db)
+    assert database.db_filename(ro_db) == filename
+    assert database.data_version(ro_db) is not None
+    with ro_db.bind_ctx([database.Team, database.Driver]):
+        assert database.Driver.select().count() == 19
+        with pytest.raises(peewee.OperationalError):
+            database.Team.create(name='New team')
+    ro_db.close()
+
+
+def test_connect_persistent_reopens_replaced_file(tmp_path):
+    """Test that persistent connection is kept, but reopened after the db file is replaced"""
+    filename = str(tmp_path / 'racing.db')
+    with database.new_db_file(filename) as new_db:
+        save_report(new_db)
+    ro_db = peewee.SqliteDatabase(None)
+    database.open_read_only(filename, db=ro_db)
+    database.connect_persistent(ro_db)
+    connection = ro_db.connection()
+    database.connect_persistent(ro_db)
+    assert ro_db.connection() is connection
+    with database.new_db_file(filename) as new_db:
+        save_report(new_db)
+    database.connect_persistent(ro_db)
+    assert ro_db.connection() is not connection
+    ro_db.close()
+
+
+def test_new_db_file_without_search_index_is_invalid(tmp_path):
+    """Test that the new db is rejected if the search index is out of sync with drivers"""
+    filename = str(tmp_path / 'racing.db')
+    with pytest.raises(SystemExit, match='search index'):
+        with database.new_db_file(filename) as new_db:
+            save_report(new_db)
+            database.DriverIndex.delete().execute(new_db)
+    assert os.listdir(tmp_path) == []
+
+
+def test_new_db_file_without_lap_index_is_invalid(tmp_path):
+    """Test that the new db is rejected if the lap index is not saved"""
+    filename = str(tmp_path / 'racing.db')
+    with pytest.raises(SystemExit, match='lap index'):
+        with database.new_db_file(filename) as new_db:
+            save_report(new_db)
+            database.LapIndex.delete().execute(new_db)
+    assert os.listdir(tmp_path) == []
+
+
+def test_new_db_file_overlapping_rebuilds(tmp_path):
+    """Test that overlapping rebuilds of one file use own temporary files, both complete and the db is valid"""
+    filename = str(tmp_path / 'racing.db')
+    with database.new_db_file(filename) as first_db:
+        save_report(first_db)
+        with database.new_db_file(filename) as second_db:
+            save_report(second_db)
+        assert os.listdir(tmp_path).count('racing.db') == 1
+    assert os.listdir(tmp_path) == ['racing.db']
+    assert os.stat(filename).st_mode & 0o777 == 0o644
+    new_db = peewee.SqliteDatabase(filename)
+    assert database.Driver.select().count(new_db) == 19
+    assert new_db.execute_sql('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    new_db.close()
@@ -1,7 +1,10 @@
 import datetime as dt
+import json
+
+import pytest
 
 import database
-from src.drivers import Driver
+from src.drivers import Driver, Quarantine
 from .conftest import DATA_PATH
 
 
@@ -101,23 +104,83 @@ def test_create_driver_from_queryset(empty_db):
     assert all((d.name, d.abbr, d.team, d.start_time, d.stop_time, d.best_lap))
 
 
-def test_save_teams_to_db(empty_db):
-    """Test that teams (parsed from data files) are saved to db (into separate table)"""
-    Driver.build_report(data_path=DATA_PATH)
-    empty_db.bind([database.Team, database.Driver])
-    Driver.save_teams_to_db(database.Team)
-    assert database.Team.select().count() == 10
-    sample_teams = ['SCUDERIA TORO ROSSO HONDA', 'MERCEDES', 'FERRARI']
-    for team in sample_teams:
-        assert team in [team.name for team in database.Team.select()]
+def test_info_fragments():
+    """Test that pre-rendered json and xml fragments contain the same info as the driver info dictionary"""
+    d = Driver(abbr='LHM', name='Lewis Hamilton', team='MERCEDES', start_time='1900-01-01 12:11:32.585000',
+               stop_time='1900-01-01 12:18:20.125000', best_lap='0:06:47.540000')
+    json_fragment, xml_fragment = d.info_fragments()
+    assert json.loads(json_fragment) == d.driver_info_dictionary()
+    assert xml_fragment.startswith('<name>Lewis Hamilton</name><abbr>LHM</abbr>')
+    assert xml_fragment.endswith('<best_lap_time>0:06:47.540</best_lap_time>')
 
 
-def test_save_drivers_to_db(empty_db):
-    """Test that drivers (parsed from data files) are saved to db. Includes saving teams table first"""
-    Driver.build_report(data_path=DATA_PATH)
-    empty_db.bind([database.Team, database.Driver])
-    Driver.save_teams_to_db(database.Team)
-    Driver.save_drivers_to_db(database.Driver, database.Team)
-    for d in database.Driver.select():
-        assert all((d.name, d.team, d.abbr, d.start_time, d.stop_time, d.best_lap))
-    assert database.Driver.select().count() == 19
+def test_all_fragments(test_db_ctx):
+    """Test that fragments of all drivers are stored in db and ordered by name or best lap. Using test db file"""
+    with test_db_ctx:
+        by_name = [json.loads(f)['name'] for f in Driver.all_fragments()]
+        assert by_name == [d.name for d in Driver.all()]
+        by_lap = [json.loads(f)['best_lap_time'] for f in Driver.all_fragments(by_best_lap=True)]
+        assert by_lap == sorted(by_lap)
+        assert all(f.startswith('<name>') for f in Driver.all_fragments('xml'))
+
+
+@pytest.fixture
+def bad_data_path(tmp_path):
+    """Data files with malformed records"""
+    (tmp_path / 'abbreviations.txt').write_text(
+        'LHM_Lewis Hamilton_MERCEDES\n'
+        'SVF_Sebastian_Vettel_FERRARI\n'
+        'broken line\n'
+        'LHM_Lewis Twin_MERCEDES\n'
+        '\n'
+        'KRF_Kimi Räikkönen_FERRARI\n', encoding='UTF-8')
+    (tmp_path / 'start.log').write_text(
+        'LHM2018-05-24_12:11:32.585\n'
+        'SVF2018-05-24_12:02:58.917\n'
+        'KRF2018-05-24_12:03:01.250\n'
+        'XXX2018-05-24_12:03:01.250\n'
+        'SVF2018-05-24_12:09:58.917\n', encoding='UTF-8')
+    (tmp_path / 'end.log').write_text(
+        'LHM2018-05-24_12:18:20.125\n'
+        'SVF2018-05-24_12:04:03.332\n'
+        'KRF2018-05-24_1x:04:13.889\n', encoding='UTF-8')
+    return str(tmp_path)
+
+
+def test_build_report_quarantines_bad_records(bad_data_path, tmp_path):
+    """Test that malformed records are written to quarantine file and counted, the good ones are parsed"""
+    quarantine_file = tmp_path / 'quarantine.log'
+    with Quarantine(str(quarantine_file)) as quarantine:
+        drivers = Driver.build_report(data_path=bad_data_path, quarantine=quarantine)
+    assert [d.name for d in drivers] == ['Lewis Hamilton', 'Sebastian_Vettel']
+    assert drivers[1].best_lap == dt.timedelta(minutes=1, seconds=4, milliseconds=415)
+    assert quarantine.counts == {
+        'malformed abbreviation line': 1,
+        'duplicate abbreviation': 1,
+        'unknown abbreviation': 1,
+        'duplicate log entry': 1,
+        'malformed log line': 1,
+        'missing stop time': 1,
+    }
+    lines = quarantine_file.read_text(encoding='UTF-8').splitlines()
+    assert len(lines) == quarantine.total == 6
+    assert lines[0] == 'abbreviations.txt:3\tmalformed abbreviation line\tbroken line'
+
+
+def test_build_report_without_quarantine(bad_data_path):
+    """Test that bad records do not fail the build if quarantine is not given"""
+    assert len(Driver.build_report(data_path=bad_data_path)) == 2
+
+
+def test_search(test_db_ctx):
+    """Test full-text search by name, abbreviation and team (prefixes, all words must match). Using test db file"""
+    with test_db_ctx:
+        total, rows = Driver.search('hamil')
+        assert total == 1 and rows[0]['name'] == 'Lewis Hamilton'
+        assert rows[0]['snippet'] == 'Lewis <b>Hamilton</b>'
+        assert Driver.search('ferrari')[0] == 6
+        assert [row['name'] for row in Driver.search('ferrari seb')[1]] == ['Sebastian Vettel']
+        assert Driver.search('LHM')[1][0]['abbr'] == 'LHM'
+        assert Driver.search('"*)(')[0] == 0
+        total, rows = Driver.search('ferrari', page=2, per_page=4)
+        assert total == 6 and len(rows) == 2
@@ -0,0 +1,34 @@
+import csv
+import gzip
+import io
+import json
+
+from src.export import csv_chunks, columns_chunks, export_db
+
+
+def test_csv_chunks(test_db_ctx):
+    """Test that the table is exported as csv in chunks (header is the first one). Using test db file"""
+    with test_db_ctx:
+        chunks = list(csv_chunks('driver', chunk_size=5))
+    assert len(chunks) == 1 + 4
+    rows = list(csv.reader(io.StringIO(b''.join(chunks).decode('utf-8'))))
+    assert rows[0] == ['id', 'name', 'abbr', 'team_id', 'start_time', 'stop_time', 'best_lap', 'best_lap_ms']
+    assert len(rows) == 20
+    assert [row[0] for row in rows[1:]] == [str(i) for i in range(1, 20)]
+
+
+def test_columns_chunks(test_db_ctx):
+    """Test that the table is exported as gzip of json lines, each is a chunk in columns. Using test db file"""
+    with test_db_ctx:
+        data = b''.join(columns_chunks('team', chunk_size=4))
+    lines = [json.loads(line) for line in gzip.decompress(data).decode('utf-8').splitlines()]
+    assert [len(line['name']) for line in lines] == [4, 4, 2]
+    assert sum((line['id'] for line in lines), []) == list(range(1, 11))
+
+
+def test_export_db(test_db_ctx, tmp_path):
+    """Test that all tables are exported to files in all formats. Using test db file"""
+    with test_db_ctx:
+        export_db(str(tmp_path))
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'driver.columns.jsonl.gz', 'driver.csv', 'team.columns.jsonl.gz', 'team.csv']
@@ -0,0 +1,72 @@
+import threading
+
+import peewee
+import pytest
+
+import src.database as database
+from src.drivers import Driver
+from src.ingest import IngestSession
+from .conftest import DATA_PATH
+
+
+def test_parse():
+    """Test that the session holds the parsed batch of drivers"""
+    session = IngestSession(data_path=DATA_PATH)
+    drivers = session.parse()
+    assert len(drivers) == 19
+    assert session.drivers is drivers
+    assert session.quarantine.total == 0
+
+
+def test_save_nothing_parsed(empty_db):
+    """Test that saving is refused before parsing"""
+    with pytest.raises(ValueError):
+        IngestSession(data_path=DATA_PATH).save(empty_db)
+
+
+def test_save(empty_db):
+    """Test that teams, drivers (with all fields), search index and lap index are saved to db"""
+    session = IngestSession(data_path=DATA_PATH)
+    session.parse()
+    session.drivers[0].biography = 'Born in Perth, Western Australia'
+    session.save(empty_db)
+    assert database.Team.select().count() == 10
+    sample_teams = ['SCUDERIA TORO ROSSO HONDA', 'MERCEDES', 'FERRARI']
+    for team in sample_teams:
+        assert team in [team.name for team in database.Team.select()]
+    assert database.Driver.select().count() == 19
+    for d in database.Driver.select():
+        assert all((d.name, d.team, d.abbr, d.start_time, d.stop_time, d.best_lap, d.best_lap_ms, d.json_fragment,
+                    d.xml_fragment))
+    assert database.DriverIndex.select().count() == 19
+    total, rows = Driver.search('perth')
+    assert total == 1 and rows[0]['name'] == session.drivers[0].name
+    assert '<b>Perth</b>' in rows[0]['snippet']
+    lap_index = database.LapIndex.get()
+    assert len(lap_index.laps) == 19 * 4
+
+
+def test_concurrent_sessions(tmp_path):
+    """Test that sessions running in threads save their own batches to their own dbs"""
+    errors = []
+
+    def ingest(filename):
+        try:
+            session = IngestSession(data_path=DATA_PATH)
+            session.parse()
+            with database.new_db_file(filename) as new_db:
+                session.save(new_db)
+        except BaseException as err:
+            errors.append(err)
+
+    filenames = [str(tmp_path / f'racing{i}.db') for i in range(4)]
+    threads = [threading.Thread(target=ingest, args=(filename,)) for filename in filenames]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    for filename in filenames:
+        db = peewee.SqliteDatabase(filename)
+        assert database.Driver.select().count(db) == 19
+        db.close()
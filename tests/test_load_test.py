@@ -0,0 +1,37 @@
+import pytest
+
+from benchmarks.load_test import generate_data, route_statistics
+from src.drivers import Quarantine
+from src.ingest import IngestSession
+
+
+def test_generate_data(tmp_path):
+    """Test that the synthetic data files are parsed without rejected records"""
+    generate_data(str(tmp_path), drivers=50, teams=5)
+    quarantine = Quarantine()
+    drivers = IngestSession(str(tmp_path), quarantine=quarantine).parse()
+    assert len(drivers) == 50
+    assert quarantine.total == 0
+    assert len({d.team for d in drivers}) <= 5
+    assert all(d.best_lap.total_seconds() > 0 for d in drivers)
+
+
+def test_generate_data_too_many_drivers(tmp_path):
+    """Test that the number of drivers is limited by the 3-letter abbreviations"""
+    with pytest.raises(ValueError):
+        generate_data(str(tmp_path), drivers=26 ** 3 + 1, teams=5)
+
+
+def test_route_statistics():
+    """Test the throughput, latency percentiles and error rate of each route and of all of them"""
+    results = [('/report', ms / 1000, True) for ms in range(1, 101)] + [('/api/v1/stats/', 0.01, False)]
+    stats = route_statistics(results, elapsed=2)
+    assert list(stats) == ['/report', '/api/v1/stats/', 'total']
+    assert stats['/report']['requests'] == 100
+    assert stats['/report']['rps'] == 50
+    assert stats['/report']['p50'] == pytest.approx(50.5)
+    assert stats['/report']['p99'] == pytest.approx(99.01)
+    assert stats['/report']['errors'] == 0
+    assert stats['/api/v1/stats/']['errors'] == 100
+    assert stats['total']['requests'] == 101
+    assert route_statistics([], elapsed=1) == {}
@@ -0,0 +1,45 @@
+import shutil
+
+from src.app import app
+import src.database as database
+import src.serve as serve
+from src.serve import warm_statements
+from src.stats import lap_statistics
+from .conftest import TEST_DB
+
+
+def test_warm_statements_runs_cached_queries(test_db_ctx, monkeypatch):
+    """Test that the queries of the statistics run on the connection although their results are cached"""
+    with test_db_ctx:
+        lap_statistics()
+        db = database.Driver._meta.database
+        executed = []
+        execute_sql = db.execute_sql
+        monkeypatch.setattr(db, 'execute_sql', lambda sql, *args, **kwargs: executed.append(sql) or
+                            execute_sql(sql, *args, **kwargs))
+        warm_statements()
+    assert any('"lapindex"' in sql for sql in executed)
+    assert any('GROUP BY' in sql and '"team"' in sql for sql in executed)
+
+
+def test_prepare_worker_keeps_warmed_connection(tmp_path):
+    """Test that the requests of the warm-up run on the connection warmed by warm_statements (not a reopened one)"""
+    db_file = tmp_path / 'racing.db'
+    shutil.copy(TEST_DB, db_file)
+    connections = []
+    warm_statements_original = serve.warm_statements
+
+    def warm_statements():
+        warm_statements_original()
+        connections.append(database.db.connection())
+
+    try:
+        serve.warm_statements = warm_statements
+        with database.db.bind_ctx(database.MODELS):
+            serve.prepare_worker(str(db_file))
+            assert database.db.connection() is connections[0]
+    finally:
+        serve.warm_statements = warm_statements_original
+        app.config['PERSISTENT_DB'] = False
+        database.db.close()
+        database.db.init(database.DATABASE)
@@ -0,0 +1,62 @@
+from src.stats import (format_lap, percentile, field_statistics, lap_statistics, pack_laps, unpack_laps,
+                       lap_histogram, count_within, count_percentile)
+
+
+def test_format_lap():
+    """Test that milliseconds are formatted as lap times in api responses"""
+    assert format_lap(73179) == '0:01:13.179'
+    assert format_lap(3_600_000 + 5) == '1:00:00.005'
+    assert format_lap(0.4) == '0:00:00.000'
+
+
+def test_percentile():
+    """Test percentiles with interpolation between closest ranks"""
+    laps = [10, 20, 30, 40]
+    assert percentile(laps, 0) == 10
+    assert percentile(laps, 100) == 40
+    assert percentile(laps, 50) == 25
+
+
+def test_field_statistics():
+    """Test the statistics of the field of lap times"""
+    stats = field_statistics([1000, 2000, 3000])
+    assert stats['drivers'] == '3'
+    assert stats['median_lap_time'] == stats['mean_lap_time'] == '0:00:02.000'
+    assert stats['spread'] == '0:00:02.000'
+    assert field_statistics([]) == {'drivers': '0'}
+
+
+def test_pack_laps():
+    """Test that packed lap times are unpacked unchanged"""
+    laps = [64415, 72013, 2 ** 31 - 1]
+    assert len(pack_laps(laps)) == 12
+    assert list(unpack_laps(pack_laps(laps))) == laps
+
+
+def test_lap_histogram():
+    """Test that all laps are counted in bins of equal width from the fastest lap"""
+    histogram = lap_histogram([1000, 1001, 1500, 2999], bins=2)
+    assert histogram == {'start_ms': 1000, 'bin_ms': 1000, 'counts': [3, 1]}
+    assert lap_histogram([1000], bins=3)['counts'] == [1, 0, 0]
+    assert lap_histogram([])['counts'] == []
+
+
+def test_count_within_and_percentile(test_db_ctx):
+    """Test the number of leading drivers within a gap and up to a percentile in the test db file"""
+    with test_db_ctx:
+        assert count_within(0) == 1
+        assert count_within(10 ** 9) == 19
+        assert count_percentile(0) == 1
+        assert count_percentile(100) == 19
+        assert count_percentile(25) == 5
+
+
+def test_lap_statistics(test_db_ctx):
+    """Test field and team statistics from the test db file"""
+    with test_db_ctx:
+        stats = lap_statistics()
+    assert stats['field']['drivers'] == '19'
+    assert len(stats['teams']) == 10
+    assert stats['teams']['team1']['name'] == 'FERRARI'
+    assert stats['teams']['team1']['gap_to_leader'] == '0:00:00.000'
+    assert sum(int(team['drivers']) for team in stats['teams'].values()) == 19
@@ -0,0 +1,43 @@
+import src.database as database
+from src.teams import Team
+
+
+def test_all(test_db_ctx):
+    """Test that Team.all() returns all teams in alphabetical order with their rosters. Using test db file"""
+    with test_db_ctx:
+        teams = Team.all()
+    assert len(teams) == 10
+    assert [t.name for t in teams] == sorted(t.name for t in teams)
+    assert sum(len(t.drivers) for t in teams) == 19
+
+
+def test_get_by_name(test_db_ctx):
+    """Test that team is found by name (case insensitive), roster is ordered by lap time. Using test db file"""
+    with test_db_ctx:
+        team = Team.get_by_name('ferrari')
+        assert Team.get_by_name('unknown') is None
+    assert team.name == 'FERRARI'
+    assert [d['abbr'] for d in team.drivers] == ['SVF', 'KRF']
+    assert team.best_lap_ms == team.drivers[0]['best_lap_ms']
+    assert team.average_lap_ms == sum(d['best_lap_ms'] for d in team.drivers) / 2
+
+
+def test_get_by_name_non_ascii(empty_db):
+    """Test that team with non-ASCII name is found by the exact name and by other case of ASCII letters"""
+    team = database.Team.create(name='ÉCURIE BLEUE')
+    database.Driver.create(name='Jean Dupont', abbr='JDU', team=team, start_time='12:00:00.000',
+                           stop_time='12:01:05.000', best_lap='0:01:05', best_lap_ms=65000)
+    assert Team.get_by_name('ÉCURIE BLEUE').name == 'ÉCURIE BLEUE'
+    assert Team.get_by_name('Écurie bleue').name == 'ÉCURIE BLEUE'
+
+
+def test_team_info_dictionary():
+    """Test the team info dictionary for api"""
+    team = Team(name='MERCEDES', drivers=[{'name': 'Lewis Hamilton', 'abbr': 'LHM', 'best_lap_ms': 73179}],
+                best_lap_ms=73179, average_lap_ms=73179.0)
+    assert team.team_info_dictionary() == {
+        'name': 'MERCEDES',
+        'drivers': {'driver1': {'name': 'Lewis Hamilton', 'abbr': 'LHM', 'best_lap_time': '0:01:13.179'}},
+        'best_lap_time': '0:01:13.179',
+        'average_lap_time': '0:01:13.179',
+    }
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from src.utils import LRUCache, SingleFlight
+
+
+def test_lru_cache_get_set():
+    """Test that cached values are returned and missing keys return default"""
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('b', 0) == 0
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """Test that the cache size is bounded and the least recently used entry is evicted"""
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    """Test that concurrent calls with the same key share one computation"""
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'value'
+
+    leader = threading.Thread(target=lambda: results.append(single_flight.do('key', compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(single_flight.do('key', compute))) for _ in range(5)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    assert calls == [1]
+    assert results == ['value'] * 6
+
+
+def test_single_flight_shares_exception_and_forgets_finished():
+    """Test that the exception is raised to the caller and finished computations are not kept"""
+    single_flight = SingleFlight()
+    with pytest.raises(ValueError):
+        single_flight.do('key', lambda: int('x'))
+    assert single_flight.do('key', lambda: 1) == 1
+    assert single_flight.do('key', lambda: 2) == 2